@@ -0,0 +1,174 @@
+#
+# Wire format of the Raptor packets and their ACKs, shared by the sender
+# and the receiver.
+#
+# Every layout the senders have used is still parsed. A packet starts with
+# its version byte, except the legacy one, which has none; a packet is
+# only taken for a version if its length matches that version's header
+# and T, otherwise it is tried as a legacy packet. ACKs have no version
+# byte and are told apart by their length.
+#
+#   legacy  SBN, ESI, K, N, T, then each symbol byte in a 16-bit word
+#   1       version, SBN, ESI, K, N, T, then T bytes of symbol
+#   2       version, SBN, ESI, K, N, T, offset, size, then T bytes
+#   3       version, stream, SBN, ESI, K, N, T, offset, size, then T bytes
+#   4       an aggregated packet: version, the number of groups, then each
+#           group: stream, SBN, K, N, T, offset, size and the number of its
+#           symbols, each an ESI and T bytes. A group holds the symbols of
+#           one source block in the packet.
+#
+# stream tells the senders sharing a receiver apart (0 before version 3).
+# offset/size place the source block in the file; size is the block's
+# length before it was zero-padded to K * T. Legacy and version 1 packets
+# carried no offset: their blocks were K * T bytes each.
+#
+
+import collections
+import struct
+import numpy
+
+PKT_VERSION = 3
+PKT_HEADER = struct.Struct('!BBHHHHHII')
+V2_HEADER = struct.Struct('!BHHHHHII')
+V1_HEADER = struct.Struct('!BHHHHH')
+LEGACY_HEADER = struct.Struct('!HHHHH')
+
+FRAME_VERSION = 4
+FRAME_HEADER = struct.Struct('!BB')
+GROUP_HEADER = struct.Struct('!BHHHHIIB')
+FRAME_SYMBOL = struct.Struct('!H')
+MAX_FRAME_SYMBOLS = 255
+
+
+def min_frame_size(T):
+    """
+    The size of an aggregated packet of a single symbol of T bytes: a
+    smaller --size leaves no room for any symbol.
+    """
+    return FRAME_HEADER.size + GROUP_HEADER.size + FRAME_SYMBOL.size + T
+
+# ACK layout: stream, SBN, flags, then the symbols of the block sent
+# (highest ESI seen + 1) and received when it was decoded or given up, and
+# the symbols the decoder used. V2_ACK_HEADER is the same without the
+# stream, and a bare 16-bit SBN is still taken as an ACK.
+ACK_HEADER = struct.Struct('!BHBHHH')
+V2_ACK_HEADER = struct.Struct('!HBHHH')
+ACK_DECODED = 0x01
+
+MAX_ESI = 0xffff                # ESIs are 16 bits on the air
+
+MALFORMED = (False, None, None, None, None, None, None, None, None, None)
+
+
+def pack_pkt(stream, SBN, ESI, K, N, T, offset, size, symbols):
+    """
+    Build a packet of one encoded symbol of T bytes, in the current
+    version (PKT_VERSION).
+    """
+    if not isinstance(symbols, str):
+        symbols = str(bytearray(symbols))
+    return PKT_HEADER.pack(PKT_VERSION, stream & 0xff, SBN & 0xffff, ESI & 0xffff,
+                           K & 0xffff, N & 0xffff, T & 0xffff, offset, size) + symbols
+
+
+def unpack_pkt(payload):
+    """
+    Parse a packet of one symbol, of any version but the aggregated one.
+    Returns (pkt_ok, stream, SBN, ESI, K, N, T, offset, size, symbols);
+    pkt_ok is False and the rest None if the packet is malformed.
+    """
+    if len(payload) < LEGACY_HEADER.size:
+        return MALFORMED
+
+    version = ord(payload[0])
+    if version == PKT_VERSION and len(payload) >= PKT_HEADER.size:
+        (version, stream, SBN, ESI, K, N, T, offset, size) = PKT_HEADER.unpack_from(payload)
+        if len(payload) == PKT_HEADER.size + T:
+            return (True, stream, SBN, ESI, K, N, T, offset, size, payload[PKT_HEADER.size:])
+    elif version == 2 and len(payload) >= V2_HEADER.size:
+        (version, SBN, ESI, K, N, T, offset, size) = V2_HEADER.unpack_from(payload)
+        if len(payload) == V2_HEADER.size + T:
+            return (True, 0, SBN, ESI, K, N, T, offset, size, payload[V2_HEADER.size:])
+    elif version == 1 and len(payload) >= V1_HEADER.size:
+        (version, SBN, ESI, K, N, T) = V1_HEADER.unpack_from(payload)
+        if len(payload) == V1_HEADER.size + T:
+            return (True, 0, SBN, ESI, K, N, T, SBN * K * T, K * T, payload[V1_HEADER.size:])
+
+    # legacy format: every byte of the symbol was sent as a 16-bit word
+    (SBN, ESI, K, N, T) = LEGACY_HEADER.unpack_from(payload)
+    if len(payload) != LEGACY_HEADER.size + 2 * T:
+        return MALFORMED
+    words = numpy.frombuffer(payload, dtype='>u2', offset=LEGACY_HEADER.size)
+    symbols = numpy.minimum(words, 255).astype(numpy.uint8).tostring()
+    return (True, 0, SBN, ESI, K, N, T, SBN * K * T, K * T, symbols)
+
+
+def pack_frame(stream, T, symbols):
+    """
+    Build an aggregated packet of symbols, a list of (SBN, ESI, K, N,
+    offset, size, symbol) of T bytes each. The symbols of a source block
+    go into one group, in the order given, under the largest N among them.
+    """
+    groups = collections.OrderedDict()      # SBN -> [K, N, offset, size, entries]
+    for (SBN, ESI, K, N, offset, size, symbol) in symbols:
+        group = groups.setdefault(SBN, [K, N, offset, size, []])
+        group[1] = max(group[1], N)
+        if not isinstance(symbol, str):
+            symbol = str(bytearray(symbol))
+        group[4].append(FRAME_SYMBOL.pack(ESI & 0xffff) + symbol)
+
+    parts = [FRAME_HEADER.pack(FRAME_VERSION, len(groups))]
+    for (SBN, (K, N, offset, size, entries)) in groups.items():
+        parts.append(GROUP_HEADER.pack(stream & 0xff, SBN & 0xffff, K & 0xffff, N & 0xffff,
+                                       T & 0xffff, offset, size, len(entries)))
+        parts.extend(entries)
+    return ''.join(parts)
+
+
+def unpack_frame(payload):
+    """
+    Return the unpack_pkt() tuples of the symbols of a packet: of every
+    symbol of an aggregated packet, else of its one symbol.
+    """
+    if len(payload) < FRAME_HEADER.size or ord(payload[0]) != FRAME_VERSION:
+        return [unpack_pkt(payload)]
+
+    unpacked = []
+    (version, groups) = FRAME_HEADER.unpack_from(payload)
+    pos = FRAME_HEADER.size
+    for i in xrange(groups):
+        if pos + GROUP_HEADER.size > len(payload):
+            break
+        (stream, SBN, K, N, T, offset, size, count) = GROUP_HEADER.unpack_from(payload, pos)
+        pos += GROUP_HEADER.size
+        if pos + count * (FRAME_SYMBOL.size + T) > len(payload):
+            break
+        for j in xrange(count):
+            (ESI,) = FRAME_SYMBOL.unpack_from(payload, pos)
+            pos += FRAME_SYMBOL.size
+            unpacked.append((True, stream, SBN, ESI, K, N, T, offset, size,
+                             payload[pos:pos + T]))
+            pos += T
+    else:
+        if pos == len(payload):
+            return unpacked
+    # not one: a legacy packet whose SBN starts with FRAME_VERSION
+    return [unpack_pkt(payload)]
+
+
+def pack_ack(stream, SBN, flags=ACK_DECODED, sent=0, received=0, used=0):
+    return ACK_HEADER.pack(stream & 0xff, SBN & 0xffff, flags, min(sent, 0xffff),
+                           min(received, 0xffff), min(used, 0xffff))
+
+
+def unpack_ack(ack):
+    """
+    Returns (stream, SBN, flags, sent, received, used), or None.
+    """
+    if len(ack) == 2:
+        return (0, struct.unpack('!H', ack)[0], ACK_DECODED, 0, 0, 0)
+    if len(ack) == V2_ACK_HEADER.size:
+        return (0,) + V2_ACK_HEADER.unpack(ack)
+    if len(ack) != ACK_HEADER.size:
+        return None
+    return ACK_HEADER.unpack(ack)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# Micro-benchmark of RaptorEncoder and RaptorDecoder over a grid of K, T
+# and repair symbols, without any radio.
+#
+# For every (K, T, repair) it times the encoder setup (constructor and
+# set_block), the encoding (get_data_access and draining the symbols) and
+# decode_block() with K + --decode-overhead of the symbols, and reports
+# MB/s of source data, per-block latency percentiles and the peak RSS. It
+# also decodes with K + o symbols for every o of --overheads to get the
+# failure rate against overhead.
+#
+# --save writes the results as a JSON baseline, together with the options,
+# the machine and the codec libraries (file name and SHA-1) they were measured
+# with; --baseline compares them to one and exits with 1 if a throughput
+# dropped, or a failure rate or the peak RSS grew, beyond --tolerance.
+# Against a baseline of another kind of CPU or another build of the codec
+# the deltas are only printed, as they say nothing about a regression.
+#
+# --code-cache also times the encoding of every block with a code_cache
+# kept in memory, the first block of a case included: that one probes
+# the matrix and is checked against RaptorEncoder.
+#
+
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+
+# from current dir
+from block_encoder import block_encoder
+from block_decoder import block_decoder
+from parallel_decoder import decode_block
+from code_cache import code_cache
+
+import os, sys
+import hashlib, json, multiprocessing, platform, random, resource, time
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """
+    Return {'p50': ..., ...} of samples, nearest rank.
+    """
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        rank = max(int(round(p / 100.0 * len(ordered))) - 1, 0)
+        result['p%d' % p] = ordered[rank]
+    return result
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def machine_info():
+    """
+    Return what identifies the machine the results are measured on.
+    """
+    cpu = platform.processor()
+    try:
+        for line in open('/proc/cpuinfo'):
+            if line.startswith('model name'):
+                cpu = line.split(':', 1)[1].strip()
+                break
+    except IOError:
+        pass
+    return {'cpu': cpu, 'cpus': multiprocessing.cpu_count(),
+            'platform': platform.platform(), 'python': platform.python_version()}
+
+
+def codec_info():
+    """
+    Return the file name and SHA-1 of the codec extension modules loaded.
+    """
+    info = {}
+    for name in ('_raptor_encoder', '_raptor_decoder'):
+        module = sys.modules.get(name)
+        path = getattr(module, '__file__', None)
+        if path is None:
+            continue
+        if path.endswith('.pyc'):
+            path = path[:-1]
+        f = open(path, 'rb')
+        info[name] = {'file': os.path.basename(path), 'sha1': hashlib.sha1(f.read()).hexdigest()}
+        f.close()
+    return info
+
+
+def same_setup(report, machine, codec):
+    """
+    Tell if a saved report was measured on the same kind of machine, with
+    the same build of the codec, as this run.
+    """
+    def builds(info):
+        return dict((name, module['sha1']) for (name, module) in info.items())
+    saved = report.get('machine') or {}
+    return (all(saved.get(key) == machine[key] for key in ('cpu', 'cpus', 'python'))
+            and builds(report.get('codec') or {}) == builds(codec))
+
+
+def describe_setup(machine, codec):
+    return "%s x %s, python %s, %s" % (
+        machine.get('cpus'), machine.get('cpu'), machine.get('python'),
+        ', '.join("%s %s" % (name, module['sha1'][:12]) for (name, module) in sorted(codec.items())))
+
+
+def received_symbols(encoded, N, T, count):
+    """
+    Return (ESIs, symbols) of count symbols picked at random out of N.
+    """
+    ESIs = sorted(random.sample(xrange(N), count))
+    symbols = ''.join(str(encoded[ESI * T:(ESI + 1) * T]) for ESI in ESIs)
+    return (ESIs, symbols)
+
+
+def bench_case(K, T, repair, blocks, decode_overhead, overheads, trials, cache=None):
+    setup = []
+    encode = []
+    cached = []
+    decode = []
+    failures = dict((o, 0) for o in overheads)
+    decodeFailures = 0
+    decoder = block_decoder()
+
+    for i in xrange(blocks):
+        source = os.urandom(K * T)
+
+        start = time.time()
+        encoder = block_encoder(K, repair, 20)
+        encoder.set_block(source, T)
+        setup.append(time.time() - start)
+
+        start = time.time()
+        encoder.get_data_access()
+        N = encoder.count_encodedSym()
+        encoded = encoder.get_encodedBlock()
+        encode.append(time.time() - start)
+
+        if cache is not None:
+            start = time.time()
+            if cache.encode(source, K, N, T) != encoded:
+                raise RuntimeError("K = %d, T = %d: code cache encodes another block" % (K, T))
+            cached.append(time.time() - start)
+
+        (ESIs, symbols) = received_symbols(encoded, N, T, min(K + decode_overhead, N))
+        start = time.time()
+        data = decode_block(decoder, K, N, T, ESIs, symbols)
+        decode.append(time.time() - start)
+        if data is None:
+            decoder = block_decoder()
+            decodeFailures += 1
+        elif data != source:
+            raise RuntimeError("K = %d, T = %d: decoded block differs from the source" % (K, T))
+
+        # a share of the failure trials on every block
+        for o in failures:
+            for j in xrange(trials // blocks + (i < trials % blocks)):
+                (ESIs, symbols) = received_symbols(encoded, N, T, K + o)
+                if decode_block(decoder, K, N, T, ESIs, symbols) is None:
+                    decoder = block_decoder()
+                    failures[o] += 1
+
+    MB = K * T / 1e6
+    result = {
+        'K': K, 'T': T, 'repair': repair,
+        'setup_ms': percentiles([t * 1e3 for t in setup]),
+        'encode_ms': percentiles([t * 1e3 for t in encode]),
+        'decode_ms': percentiles([t * 1e3 for t in decode]),
+        'encode_MBps': MB * len(encode) / sum(encode),
+        'decode_MBps': MB * len(decode) / sum(decode),
+        'decode_failures': decodeFailures,
+        'failure_rate': dict((str(o), float(n) / trials) for (o, n) in failures.items()),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+    if cached:
+        result['cached_encode_ms'] = percentiles([t * 1e3 for t in cached])
+        result['cached_encode_MBps'] = MB * len(cached) / sum(cached)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the deltas of results against baseline; return the number of
+    regressions beyond tolerance (a fraction).
+    """
+    regressions = 0
+    for (case, new) in sorted(results.items()):
+        old = baseline.get(case)
+        if old is None:
+            print "%-24s not in the baseline" % case
+            continue
+
+        for key in ('encode_MBps', 'decode_MBps', 'cached_encode_MBps'):
+            if key not in new or key not in old:
+                continue
+            delta = (new[key] - old[key]) / old[key]
+            bad = delta < -tolerance
+            regressions += bad
+            print "%-24s %-12s %10.3f -> %10.3f (%+.1f%%)%s" % (
+                case, key, old[key], new[key], delta * 100, bad and "  REGRESSION" or "")
+
+        delta = float(new['peak_rss_kb'] - old['peak_rss_kb']) / old['peak_rss_kb']
+        bad = delta > tolerance
+        regressions += bad
+        print "%-24s %-12s %10d -> %10d (%+.1f%%)%s" % (
+            case, 'peak_rss_kb', old['peak_rss_kb'], new['peak_rss_kb'], delta * 100,
+            bad and "  REGRESSION" or "")
+
+        for (o, rate) in sorted(new['failure_rate'].items(), key=lambda x: int(x[0])):
+            if o not in old['failure_rate']:
+                continue
+            bad = rate - old['failure_rate'][o] > tolerance
+            regressions += bad
+            print "%-24s %-12s %10.3f -> %10.3f%s" % (
+                case, 'fail@+' + o, old['failure_rate'][o], rate, bad and "  REGRESSION" or "")
+    return regressions
+
+
+def int_list(value):
+    return [int(x) for x in value.split(',')]
+
+
+def main():
+
+    parser = OptionParser (option_class=eng_option, conflict_handler="resolve")
+    parser.add_option("-K", "--srcSymNum", default="100,1000",
+                      help="set source symbols per block, comma separated [default=%default]")
+    parser.add_option("-T", "--packLen", default="200",
+                      help="set symbol sizes, comma separated [default=%default]")
+    parser.add_option("-r", "--repair", default="5,10,20",
+                      help="set repair symbols in %% of K, comma separated [default=%default]")
+    parser.add_option("-n", "--blocks", type="intx", default=10,
+                      help="set blocks encoded and decoded per case [default=%default]")
+    parser.add_option("", "--decode-overhead", type="intx", default=2,
+                      help="set symbols beyond K the timed decodes get [default=%default]")
+    parser.add_option("", "--overheads", default="0,1,2,5",
+                      help="set symbols beyond K for the failure rate, comma separated [default=%default]")
+    parser.add_option("", "--trials", type="intx", default=20,
+                      help="set decodes per overhead for the failure rate [default=%default]")
+    parser.add_option("", "--seed", type="intx", default=0,
+                      help="set seed of the symbols picked for decoding [default=%default]")
+    parser.add_option("", "--save", default=None,
+                      help="write the results as a JSON baseline to this file")
+    parser.add_option("", "--baseline", default=None,
+                      help="compare the results with this JSON baseline")
+    parser.add_option("", "--tolerance", type="eng_float", default=0.1,
+                      help="set relative change counted as a regression [default=%default]")
+    parser.add_option("", "--code-cache", action="store_true", default=False,
+                      help="also time encoding with a code_cache")
+
+    (options, args) = parser.parse_args ()
+    if len(args) != 0:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    random.seed(options.seed)
+    overheads = int_list(options.overheads)
+
+    results = {}
+    for K in int_list(options.srcSymNum):
+        for T in int_list(options.packLen):
+            for pct in int_list(options.repair):
+                repair = max(K * pct // 100, max(overheads), options.decode_overhead)
+                case = "K=%d,T=%d,R=%d%%" % (K, T, pct)
+                cache = None
+                if options.code_cache:
+                    cache = code_cache()
+                result = bench_case(K, T, repair, options.blocks, options.decode_overhead,
+                                    overheads, options.trials, cache)
+                results[case] = result
+                print "%-24s setup %7.2f ms  encode %7.2f MB/s (p99 %7.2f ms)  decode %7.2f MB/s (p99 %7.2f ms)  rss %d kB" % (
+                    case, result['setup_ms']['p50'], result['encode_MBps'],
+                    result['encode_ms']['p99'], result['decode_MBps'],
+                    result['decode_ms']['p99'], result['peak_rss_kb'])
+                if cache is not None:
+                    print "%-24s cached encode %7.2f MB/s (p50 %7.2f ms, p99 %7.2f ms)" % (
+                        case, result['cached_encode_MBps'], result['cached_encode_ms']['p50'],
+                        result['cached_encode_ms']['p99'])
+                print "%-24s failure rate: %s" % (case, '  '.join(
+                    "+%s: %.3f" % (o, rate) for (o, rate) in
+                    sorted(result['failure_rate'].items(), key=lambda x: int(x[0]))))
+
+    machine = machine_info()
+    codec = codec_info()
+    if options.save:
+        report = {'machine': machine, 'codec': codec,
+                  'options': vars(options), 'results': results}
+        f = open(options.save, 'w')
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.close()
+
+    if options.baseline:
+        f = open(options.baseline)
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(results, baseline['results'], options.tolerance)
+        if not same_setup(baseline, machine, codec):
+            print "%s was measured on %s;" % (
+                options.baseline, describe_setup(baseline.get('machine') or {}, baseline.get('codec') or {}))
+            print "this run on %s: not checked for regressions" % describe_setup(machine, codec)
+        elif regressions:
+            print "%d regression(s) against %s" % (regressions, options.baseline)
+            sys.exit(1)
+        else:
+            print "no regression against %s" % options.baseline
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,304 @@
+#
+# In-process stand-in for my_top_block: two "top blocks" joined by a pair
+# of emulated channels, one per direction, so that a sender and a receiver
+# cs_mac can talk to each other without USRPs.
+#
+# A channel sends one packet after the other at the configured bitrate
+# (payload plus mod_pkts framing), delivers it to the peer's
+# phy_rx_callback after the configured latency, and drops it as its loss
+# model decides. Loss models are given as strings:
+#
+#   none                        no loss
+#   bernoulli:RATE              independent loss with probability RATE
+#   ge:P,R[,LOSS_GOOD,LOSS_BAD] Gilbert-Elliott bursts: P is the chance to go
+#                               from the good to the bad state per packet, R
+#                               to come back; the states lose packets with
+#                               LOSS_GOOD (default 0) and LOSS_BAD (default 1)
+#   trace:FILE                  replay FILE, a list of 0 (received) and 1
+#                               (lost), one per packet, from the start again
+#                               when it runs out
+#
+
+import collections
+import random
+import threading
+import time
+
+# from current dir
+from pacer import FRAME_OVERHEAD
+
+
+class bernoulli_loss(object):
+    def __init__(self, rate, rng=random):
+        self.rate = rate
+        self.rng = rng
+
+    def lost(self):
+        return self.rng.random() < self.rate
+
+
+class gilbert_elliott_loss(object):
+    def __init__(self, p, r, loss_good=0.0, loss_bad=1.0, rng=random):
+        self.p = p
+        self.r = r
+        self.loss = (loss_good, loss_bad)
+        self.rng = rng
+        self.bad = False
+
+    def lost(self):
+        lost = self.rng.random() < self.loss[self.bad]
+        if self.bad:
+            self.bad = self.rng.random() >= self.r
+        else:
+            self.bad = self.rng.random() < self.p
+        return lost
+
+
+class trace_loss(object):
+    def __init__(self, trace):
+        if not trace:
+            raise ValueError("empty loss trace")
+        self.trace = trace
+        self.index = 0
+
+    def lost(self):
+        lost = self.trace[self.index]
+        self.index = (self.index + 1) % len(self.trace)
+        return lost
+
+
+def make_loss_model(spec, seed=None):
+    """
+    Build the loss model described by spec (see the top of this file),
+    drawing from a random generator seeded with seed.
+    """
+    (kind, sep, args) = spec.partition(':')
+    rng = random.Random(seed)
+    if kind == 'none':
+        return bernoulli_loss(0.0, rng)
+    if kind == 'bernoulli':
+        return bernoulli_loss(float(args), rng)
+    if kind == 'ge':
+        return gilbert_elliott_loss(*[float(x) for x in args.split(',')], rng=rng)
+    if kind == 'trace':
+        trace = [bool(int(x)) for x in open(args).read().split()]
+        return trace_loss(trace)
+    raise ValueError("unknown loss model: %r" % (spec,))
+
+
+class channel(object):
+    """
+    One direction of the link: queues packets and hands them to callback
+    from a thread of its own.
+    """
+
+    def __init__(self, callback, loss, bitrate, latency):
+        self.callback = callback
+        self.loss = loss
+        self.bitrate = bitrate             # bits/sec, 0 for no limit
+        self.latency = latency             # seconds
+        self.busy_until = 0                # end of the last packet on the air
+        self.packets = collections.deque() # (delivery time, payload, lost)
+        self.cond = threading.Condition()
+        self.running = False
+        self.sent = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def send(self, payload):
+        self.cond.acquire()
+        try:
+            now = time.time()
+            start = max(now, self.busy_until)
+            if self.bitrate > 0:
+                self.busy_until = start + (len(payload) + FRAME_OVERHEAD) * 8.0 / self.bitrate
+            else:
+                self.busy_until = start
+            lost = self.loss.lost()
+            self.sent += 1
+            self.dropped += lost
+            self.packets.append((self.busy_until + self.latency, payload, lost))
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        return True
+
+    def busy(self):
+        """
+        Return True while a packet is on the air.
+        """
+        return time.time() < self.busy_until
+
+    def backlog(self):
+        """
+        Return the number of packets not delivered yet.
+        """
+        return len(self.packets)
+
+    def queued(self):
+        """
+        Return the number of packets not on the air yet, as in the
+        modulator's queue: the ones after the packet being sent.
+        """
+        if self.bitrate <= 0:
+            return 0
+        self.cond.acquire()
+        try:
+            # the packets go on the air in order; one is queued until its
+            # airtime starts
+            now = time.time()
+            count = 0
+            for (due, payload, lost) in reversed(self.packets):
+                airtime = (len(payload) + FRAME_OVERHEAD) * 8.0 / self.bitrate
+                if due - self.latency - airtime <= now:
+                    break
+                count += 1
+            return count
+        finally:
+            self.cond.release()
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.cond.acquire()
+        self.running = False
+        self.cond.notify()
+        self.cond.release()
+
+    def wait(self):
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while self.running and not self.packets:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                (due, payload, lost) = self.packets[0]
+            finally:
+                self.cond.release()
+
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if not lost:
+                self.callback(True, payload)
+            self.cond.acquire()
+            self.packets.popleft()
+            self.cond.release()
+
+
+class loopback_path(object):
+    """
+    What cs_mac uses of transmit_path and receive_path.
+    """
+
+    def __init__(self, tx_channel, rx_channel, bitrate):
+        self.tx_channel = tx_channel
+        self.rx_channel = rx_channel
+        self._bitrate = bitrate
+
+    def send_pkt(self, payload='', eof=False):
+        if eof:
+            return True
+        return self.tx_channel.send(payload)
+
+    def bitrate(self):
+        return self._bitrate
+
+    def samples_per_symbol(self):
+        return 1
+
+    def carrier_sensed(self):
+        return self.rx_channel.busy()
+
+    def set_carrier_threshold(self, threshold):
+        pass
+
+
+class loopback_top_block(object):
+    """
+    Drop-in for my_top_block on one end of a loopback link.
+
+    With sense_carrier set, carrier_sensed() is True while the peer's
+    packet is on the air, so the two ends share the medium like the
+    half-duplex radios do.
+    """
+
+    def __init__(self, tx_channel, rx_channel, bitrate, sense_carrier=False):
+        self.txpath = loopback_path(tx_channel, rx_channel, bitrate)
+        self.rxpath = self.txpath
+        self.sense_carrier = sense_carrier
+
+    def send_pkt(self, payload='', eof=False):
+        return self.txpath.send_pkt(payload, eof)
+
+    def tx_queue_depth(self):
+        """
+        Return the number of packets waiting for the emulated modulator
+        """
+        return self.txpath.tx_channel.queued()
+
+    def carrier_sensed(self):
+        """
+        Return True if the receive path thinks there's carrier
+        """
+        return self.sense_carrier and self.rxpath.carrier_sensed()
+
+    def set_freq(self, target_freq):
+        pass
+
+    def start(self):
+        self.txpath.tx_channel.start()
+
+    def stop(self):
+        self.txpath.tx_channel.stop()
+
+    def wait(self):
+        self.txpath.tx_channel.wait()
+
+    def wait_idle(self):
+        """
+        Wait until every packet sent from this end has been delivered.
+        """
+        while self.txpath.tx_channel.backlog():
+            time.sleep(0.01)
+
+
+def add_options(normal, expert):
+    """
+    Adds the options of the emulated link to the Options Parser
+    """
+    normal.add_option("", "--loss", default="none",
+                      help="set loss model of the forward link: none, bernoulli:RATE, "
+                           "ge:P,R[,LOSS_GOOD,LOSS_BAD] or trace:FILE [default=%default]")
+    normal.add_option("", "--ack-loss", default="none",
+                      help="set loss model of the reverse link [default=%default]")
+    normal.add_option("", "--bitrate", type="eng_float", default=100e3,
+                      help="set link bitrate, 0 for no limit [default=%default]")
+    normal.add_option("", "--latency", type="eng_float", default=0.001,
+                      help="set one-way latency in seconds [default=%default]")
+    normal.add_option("", "--seed", type="intx", default=0,
+                      help="set seed of the loss models [default=%default]")
+    expert.add_option("", "--sense-carrier", action="store_true", default=False,
+                      help="make each end sense the other's packets as carrier")
+
+
+def loopback_pair(tx_callback, rx_callback, options):
+    """
+    Return the top blocks (tx_tb, rx_tb) of a link from the sending to
+    the receiving end: tx_callback gets what rx_tb sends (the ACKs),
+    rx_callback what tx_tb sends.
+    """
+    forward = channel(rx_callback, make_loss_model(options.loss, options.seed),
+                      options.bitrate, options.latency)
+    reverse = channel(tx_callback, make_loss_model(options.ack_loss, options.seed + 1),
+                      options.bitrate, options.latency)
+    tx_tb = loopback_top_block(forward, reverse, options.bitrate, options.sense_carrier)
+    rx_tb = loopback_top_block(reverse, forward, options.bitrate, options.sense_carrier)
+    return (tx_tb, rx_tb)
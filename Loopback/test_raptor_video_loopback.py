@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Runs the MACs of test_raptor_video_tx.py and test_raptor_video_rx.py in
+# one process, joined by the emulated link of channel_emulator.py instead
+# of two USRPs, and checks the received file against the sent one.
+#
+# The channel drops the packets, so the receiver emulates no loss of its
+# own; -p is only the sender's guess for its repair symbols.
+#
+
+from gnuradio import eng_notation
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+
+# from current dir
+import test_raptor_video_tx
+import test_raptor_video_rx
+from parallel_decoder import parallel_decoder
+from rx_ring import rx_ring
+from repair_estimator import repair_estimator
+from uep import uep_allocator
+from code_cache import code_cache
+from pacer import pacer
+from backpressure import tx_backpressure
+from video_source import video_source
+from h264_blocker import h264_blocker
+import channel_emulator
+import playout
+import raptor_packet
+
+import os, sys
+import threading, time
+
+
+def same_contents(a, b, chunk=1 << 20):
+    """
+    Return True if the files a and b hold the same bytes, read a chunk
+    at a time.
+    """
+    while True:
+        (x, y) = (a.read(chunk), b.read(chunk))
+        if x != y:
+            return False
+        if not x:
+            return True
+
+
+def main():
+
+    parser = OptionParser (option_class=eng_option, conflict_handler="resolve")
+    expert_grp = parser.add_option_group("Expert")
+    parser.add_option("-s", "--size", type="eng_float", default=1500,
+                      help="set packet size [default=%default]")
+    parser.add_option("-v","--verbose", action="store_true", default=False)
+    parser.add_option("-o", "--output", default="./output_raptor.264",
+                      help="set file to write the received video to [default=%default]")
+
+    test_raptor_video_rx.cs_mac.add_options(parser, expert_grp)
+    test_raptor_video_tx.cs_mac.add_options(parser, expert_grp)
+    channel_emulator.add_options(parser, expert_grp)
+    playout.add_options(parser, expert_grp)
+
+    (options, args) = parser.parse_args ()
+    if len(args) != 0:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    if options.aggregate and options.size < raptor_packet.min_frame_size(options.packLen):
+        sys.stderr.write("--aggregate needs a --size of at least %d bytes for %d-byte symbols\n"
+                         % (raptor_packet.min_frame_size(options.packLen), options.packLen))
+        sys.exit(1)
+
+    source = video_source(options.input)
+    if options.blocking != 'bytes':
+        source = h264_blocker(source, options.blocking == 'gop')
+    received_file = open(options.output, 'w+')
+
+    rx_mac = test_raptor_video_rx.cs_mac(0, received_file, verbose=options.verbose,
+                                         overhead=options.overhead, retry_step=options.retry_step,
+                                         block_timeout=options.block_timeout,
+                                         ack_interval=options.ack_interval,
+                                         idle_decoders=options.idle_decoders)
+
+    # fork the decoder processes before any other thread exists
+    decoders = None
+    if options.decoders > 0:
+        decoders = parallel_decoder(options.decoders, options.slot_size, rx_mac.block_decoded)
+        decoders.start()
+        rx_mac.set_decoders(decoders)
+    ring = None
+    if options.rx_ring > 0:
+        ring = rx_ring(rx_mac.handle_packet, options.rx_ring, options.rx_batch)
+        rx_mac.set_rx_ring(ring)
+
+    tx_mac = test_raptor_video_tx.cs_mac(verbose=options.verbose, stream=options.stream,
+                                         idle_encoders=options.idle_encoders)
+    if options.adaptive:
+        tx_mac.set_estimator(repair_estimator(options.PLR / 100.0, options.target_failure,
+                                              options.loss_smoothing))
+    if options.uep:
+        tx_mac.set_uep(uep_allocator([float(x) for x in options.uep_weights.split(',')]))
+    cache = None
+    if options.code_cache is not None:
+        cache = code_cache(options.code_cache, options.code_cache_size)
+        tx_mac.set_code_cache(cache)
+
+    (tx_tb, rx_tb) = channel_emulator.loopback_pair(tx_mac.phy_rx_callback,
+                                                    rx_mac.phy_rx_callback, options)
+    tx_mac.set_top_block(tx_tb)
+    rx_mac.set_top_block(rx_tb)
+    player = playout.make_playout(options)
+    if player is not None:
+        rx_mac.set_playout(player)
+    if options.bitrate > 0:
+        tx_mac.set_pacer(pacer(options.bitrate, options.utilisation, options.burst))
+        if options.tx_high_water > 0:
+            tx_mac.set_backpressure(tx_backpressure(tx_tb.tx_queue_depth, options.tx_high_water,
+                                                    options.tx_low_water))
+
+    print "loss:           %s (ACKs: %s)" % (options.loss, options.ack_loss)
+    print "bitrate:        %sb/sec" % (eng_notation.num_to_str(options.bitrate),)
+    print "latency:        %s sec" % (eng_notation.num_to_str(options.latency),)
+
+    tx_tb.start()
+    rx_tb.start()
+    receiver = threading.Thread(target=rx_mac.main_loop)
+    receiver.daemon = True
+    receiver.start()
+
+    startTime = time.time()
+    frameSize = 0
+    if options.aggregate:
+        frameSize = int(options.size)
+    tx_mac.main_loop(source, options.packLen, options.srcSymNum, options.PLR,
+                     options.pipeline, options.queue_depth, options.rateless,
+                     frameSize, options.interleave)
+
+    # let the receiver decode, or give up, the blocks still open
+    tx_tb.wait_idle()
+    if ring is not None:
+        ring.flush()
+    while not all(block.done for block in rx_mac.blocks.values()):
+        time.sleep(0.01)
+    endTime = time.time()
+
+    rx_mac.stop()
+    receiver.join()
+    tx_tb.stop()
+    rx_tb.stop()
+    tx_tb.wait()
+    rx_tb.wait()
+    if ring is not None:
+        ring.stop()
+    if decoders is not None:
+        decoders.stop()
+    if player is not None:
+        player.close()
+
+    source.close()
+    file_length = sum(block.size for block in rx_mac.blocks.values())
+
+    forward = tx_tb.txpath.tx_channel
+    reverse = rx_tb.txpath.tx_channel
+    decoded = sum(1 for block in rx_mac.blocks.values() if block.decoded)
+    print "packets:        %d sent, %d dropped" % (forward.sent, forward.dropped)
+    print "ACKs:           %d sent, %d dropped" % (reverse.sent, reverse.dropped)
+    print "source blocks:  %d of %d decoded" % (decoded, len(rx_mac.blocks))
+    if player is not None:
+        print "playout:        %d bytes, %d blocks skipped, %d dropped" % (
+            player.written, player.skipped, player.dropped)
+    print "encoders:       %d built, %d reused; decoders: %d built, %d reused" % (
+        tx_mac.encoders.built, tx_mac.encoders.reused,
+        rx_mac.decoder_pool.built, rx_mac.decoder_pool.reused)
+    if ring is not None:
+        print ring.report()
+    if tx_mac.backpressure is not None:
+        print "tx queue:       reached %d packets %d times, %.3f sec waiting" % (
+            tx_mac.backpressure.high, tx_mac.backpressure.stalls, tx_mac.backpressure.waited)
+    if cache is not None:
+        print "code cache:     %d hits, %d misses, %d checked with RaptorEncoder" % (
+            cache.hits, cache.misses, cache.checks)
+    print "elapsed:        %.3f sec, goodput %sb/sec" % (
+        endTime - startTime,
+        eng_notation.num_to_str(file_length * 8 / (endTime - startTime)))
+
+    received_file.flush()
+    received_file.seek(0)
+    if options.input == '-':
+        print "received %d bytes, not compared with stdin" % (file_length,)
+        received_file.close()
+        return
+    source_file = open(options.input, 'rb')
+    same = same_contents(received_file, source_file)
+    source_file.close()
+    received_file.close()
+    if same:
+        print "received file matches the source"
+    else:
+        print "received file differs from the source (%d of %d bytes)" % (
+            os.path.getsize(options.output), os.path.getsize(options.input))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
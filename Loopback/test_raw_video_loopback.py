@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Runs the MACs of test_raw_video_tx.py and test_raw_video_rx.py in one
+# process, joined by the emulated link of channel_emulator.py instead of
+# two USRPs. The channel drops the packets, so the receiver emulates no
+# loss of its own.
+#
+
+from gnuradio import eng_notation
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+
+# from current dir
+import test_raw_video_tx
+import test_raw_video_rx
+from pacer import pacer
+from backpressure import tx_backpressure
+from video_source import video_source
+import channel_emulator
+import playout
+
+import os, sys
+import time
+
+
+def main():
+
+    parser = OptionParser (option_class=eng_option, conflict_handler="resolve")
+    expert_grp = parser.add_option_group("Expert")
+    parser.add_option("-v","--verbose", action="store_true", default=False)
+    parser.add_option("-o", "--output", default="./output_no_raptor.264",
+                      help="set file to write the received video to [default=%default]")
+
+    test_raw_video_rx.cs_mac.add_options(parser, expert_grp)
+    test_raw_video_tx.cs_mac.add_options(parser, expert_grp)
+    channel_emulator.add_options(parser, expert_grp)
+    playout.add_options(parser, expert_grp)
+
+    (options, args) = parser.parse_args ()
+    if len(args) != 0:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    source = video_source(options.input)
+    received_file = open(options.output, 'w')
+
+    rx_mac = test_raw_video_rx.cs_mac(0, received_file, verbose=options.verbose)
+    tx_mac = test_raw_video_tx.cs_mac(verbose=options.verbose)
+
+    (tx_tb, rx_tb) = channel_emulator.loopback_pair(tx_mac.phy_rx_callback,
+                                                    rx_mac.phy_rx_callback, options)
+    tx_mac.set_top_block(tx_tb)
+    rx_mac.set_top_block(rx_tb)
+    player = playout.make_playout(options)
+    if player is not None:
+        rx_mac.set_playout(player)
+    if options.bitrate > 0:
+        tx_mac.set_pacer(pacer(options.bitrate, options.utilisation, options.burst))
+        if options.tx_high_water > 0:
+            tx_mac.set_backpressure(tx_backpressure(tx_tb.tx_queue_depth, options.tx_high_water,
+                                                    options.tx_low_water))
+
+    print "loss:           %s" % (options.loss,)
+    print "bitrate:        %sb/sec" % (eng_notation.num_to_str(options.bitrate),)
+    print "latency:        %s sec" % (eng_notation.num_to_str(options.latency),)
+
+    tx_tb.start()
+    rx_tb.start()
+
+    startTime = time.time()
+    tx_mac.main_loop(source, options.packetLen)
+    tx_tb.wait_idle()
+    endTime = time.time()
+
+    tx_tb.stop()
+    rx_tb.stop()
+    tx_tb.wait()
+    rx_tb.wait()
+    if player is not None:
+        player.close()
+    received_file.close()
+    source.close()
+
+    forward = tx_tb.txpath.tx_channel
+    print "packets:        %d sent, %d dropped" % (forward.sent, forward.dropped)
+    if player is not None:
+        print "playout:        %d bytes, %d packets skipped, %d dropped" % (
+            player.written, player.skipped, player.dropped)
+    print "elapsed:        %.3f sec, %s packets/sec" % (
+        endTime - startTime,
+        eng_notation.num_to_str(forward.sent / (endTime - startTime)))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,47 @@
+#
+# Buffer helpers around the RaptorDecoder of the SWIG-generated
+# raptor_decoder.py, which swig writes anew on every build: they live
+# here so that the generated wrapper is left as it is.
+#
+
+# from current dir
+import raptor_decoder
+from raptor_decoder import vectoruc
+
+
+class block_decoder(raptor_decoder.RaptorDecoder):
+    """
+    RaptorDecoder that takes the received symbols from byte buffers.
+    """
+
+    def set_symbol(self, buf):
+        """
+        set_data() for one symbol held in any byte buffer (str, bytearray,
+        memoryview or uint8 NumPy array); the bytes are converted to a
+        vectoruc in a single call instead of one append() per byte.
+        """
+        return self.set_data(vectoruc(bytearray(buf)))
+
+    def set_symbols(self, ESIs, buf, T):
+        """
+        Feed all received symbols of a block in one call.
+
+        ESIs must be ascending and buf must hold the matching symbols back
+        to back, T bytes each. The decoder expects one data entry for every
+        position up to the last ESI, so positions that were not received get
+        a zeroed placeholder. Returns the number of placeholders, which is
+        the loss count to pass to set_parameters().
+        """
+        buf = bytearray(buf)
+        blank = vectoruc(T, 0)
+        pos = 0
+        for (i, ESI) in enumerate(ESIs):
+            if ESI < pos:
+                continue
+            while pos < ESI:
+                self.set_data(blank)
+                pos += 1
+            self.set_ESI(ESI)
+            self.set_data(vectoruc(buf[i * T:(i + 1) * T]))
+            pos += 1
+        return pos - len(ESIs)
@@ -0,0 +1,115 @@
+#
+# State of the source blocks a receiver is working on, keyed by
+# (stream, SBN).
+#
+# A block_state has fixed slots instead of a __dict__. The received ESIs
+# are kept in a 16-bit array next to a bitmap of them (which also drops
+# duplicates), the symbols back to back in a bytearray. Both buffers are
+# released once the block is decoded or given up; what remains of a
+# finished block is enough to acknowledge it again.
+#
+
+import array
+
+
+class block_state(object):
+    """
+    One source block: its parameters, received symbols, decode progress
+    and timestamps.
+    """
+
+    __slots__ = ('K', 'N', 'T', 'offset', 'size',
+                 'ESIs', 'bitmap', 'symbols',
+                 'lossMask',
+                 'nextAttempt', 'attempted', 'pending', 'final', 'done', 'decoded',
+                 'sent', 'report', 'firstTime', 'lastTime', 'ackTime')
+
+    def __init__(self, K, N, T, offset, size, nextAttempt, now):
+        self.K = K
+        self.N = N
+        self.T = T
+        self.offset = offset
+        self.size = size
+        self.ESIs = array.array('H')
+        self.bitmap = bytearray((N + 7) // 8)
+        self.symbols = bytearray()
+        self.lossMask = None            # ESIs the receiver emulates as lost
+        self.nextAttempt = nextAttempt  # symbols for the next decoding attempt
+        self.attempted = 0              # symbols of the last attempt
+        self.pending = False            # an attempt is running
+        self.final = False              # the last attempt has been started
+        self.done = False               # decoded or given up
+        self.decoded = False
+        self.sent = 0                   # highest ESI seen + 1
+        self.report = None              # what the ACK tells the sender
+        self.firstTime = now
+        self.lastTime = now
+        self.ackTime = None
+
+    def add_symbol(self, ESI, symbol):
+        """
+        Store a received symbol. Returns False if ESI was already there.
+        """
+        (byte, bit) = (ESI >> 3, 1 << (ESI & 7))
+        if byte >= len(self.bitmap):
+            self.bitmap.extend(bytearray(byte + 1 - len(self.bitmap)))
+        elif self.bitmap[byte] & bit:
+            return False
+        self.bitmap[byte] |= bit
+        self.ESIs.append(ESI)
+        self.symbols += symbol
+        return True
+
+    def count(self):
+        return len(self.ESIs)
+
+    def release(self):
+        """
+        Drop the received symbols of a finished block.
+        """
+        self.ESIs = self.bitmap = self.symbols = self.lossMask = None
+
+
+class block_table(object):
+    """
+    The block_state of every (stream, SBN) seen, and which of them are
+    still open (neither decoded nor given up).
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.open = set()
+
+    def get(self, key):
+        return self.blocks.get(key)
+
+    def add(self, key, state):
+        self.blocks[key] = state
+        self.open.add(key)
+
+    def close(self, key):
+        """
+        Mark a block decoded or given up and release its symbols.
+        """
+        state = self.blocks[key]
+        state.done = True
+        state.release()
+        self.open.discard(key)
+
+    def open_items(self):
+        """
+        Return the (key, state) of the open blocks.
+        """
+        return [(key, self.blocks[key]) for key in self.open]
+
+    def items(self):
+        return self.blocks.items()
+
+    def values(self):
+        return self.blocks.values()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, key):
+        return self.blocks[key]
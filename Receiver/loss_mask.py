@@ -0,0 +1,100 @@
+#
+# Packet loss emulated by the receivers (-p): which packets are thrown
+# away as if they had not arrived.
+#
+# The pattern is drawn with numpy ahead of time, a whole source block or a
+# run of packet numbers at once, into a boolean array that each packet
+# looks up by its ESI or pktno. Every array has a generator of its own,
+# seeded with --loss-seed and the (stream, SBN) of the block or the number
+# of the run, so the same options lose the same packets whatever order
+# they arrive in, from one run of a receiver to the next.
+#
+# With --loss-burst above 1 the lost packets come in runs of that mean
+# (geometric) length instead of one by one; how many are lost stays the
+# same.
+#
+
+import numpy
+
+# tags keeping the generators of the different arrays apart
+BLOCK, EXTENSION, PACKETS = range(3)
+
+
+def burst_mask(rng, n, lost, burst=1.0, first=0):
+    """
+    Return a boolean array of n entries, lost of them True, in runs of
+    mean length burst, drawn from rng. Entries before first are never
+    lost.
+    """
+    mask = numpy.zeros(n, dtype=bool)
+    room = n - first
+    lost = min(lost, room)
+    if lost <= 0:
+        return mask
+    if burst <= 1:
+        mask[first + rng.choice(room, lost, replace=False)] = True
+        return mask
+
+    # cut the lost entries into runs of geometric length
+    lengths = rng.geometric(1.0 / burst, lost)
+    ends = numpy.cumsum(lengths)
+    runs = numpy.searchsorted(ends, lost) + 1
+    lengths = lengths[:runs]
+    lengths[-1] -= ends[runs - 1] - lost
+
+    # order the runs and the room - lost entries kept at random; a run
+    # at place p of that order starts p plus the lengths before it, less
+    # one each
+    places = numpy.sort(rng.choice(room - lost + runs, runs, replace=False))
+    starts = first + places + numpy.cumsum(lengths) - lengths - numpy.arange(runs)
+    within = numpy.arange(lost) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+    mask[numpy.repeat(starts, lengths) + within] = True
+    return mask
+
+
+class loss_mask(object):
+    """
+    Loss patterns of the source blocks (raptor receiver) and of the
+    packet numbers (raw receiver) at a packet loss rate of PLR percent.
+    """
+
+    def __init__(self, PLR, seed=0, burst=1.0, run=1024):
+        self.PLR = PLR
+        self.seed = seed
+        self.burst = burst
+        self.run = run          # packet numbers drawn at once
+        self.runs = {}          # run number -> mask of its packet numbers
+
+    def rng(self, *key):
+        return numpy.random.RandomState([self.seed & 0xffffffff] + [x & 0xffffffff for x in key])
+
+    def block(self, key, K, N):
+        """
+        Return the mask of ESIs 0 to N - 1 of the source block key:
+        K * PLR / 100 of them lost, never ESI 0.
+        """
+        return burst_mask(self.rng(BLOCK, *key), N, K * self.PLR // 100, self.burst, first=1)
+
+    def extend(self, key, mask, ESI):
+        """
+        Return mask grown to cover ESI, for a rateless sender going on
+        beyond N. The new ESIs are lost at PLR percent; the mask at least
+        doubles, so a block is extended a few times only.
+        """
+        start = len(mask)
+        n = max(start, ESI + 1 - start, 1)
+        rng = self.rng(EXTENSION, start, *key)
+        lost = rng.binomial(n, self.PLR / 100.0)
+        return numpy.concatenate((mask, burst_mask(rng, n, lost, self.burst)))
+
+    def packet_lost(self, pktno):
+        """
+        Return True if the packet numbered pktno is lost.
+        """
+        (run, index) = divmod(pktno, self.run)
+        mask = self.runs.get(run)
+        if mask is None:
+            rng = self.rng(PACKETS, run)
+            mask = burst_mask(rng, self.run, rng.binomial(self.run, self.PLR / 100.0), self.burst)
+            self.runs[run] = mask
+        return mask[index]
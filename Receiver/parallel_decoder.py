@@ -0,0 +1,378 @@
+#
+# Decoding of complete source blocks in a pool of worker processes.
+#
+# Every worker takes its RaptorDecoders from a decoder_pool. The received
+# symbols and ESIs of a block are copied into a slot of shared memory,
+# only the slot number and the block parameters go through the task
+# queue, and the worker writes the decoded block back into the same slot.
+# RaptorDecoder.decode() holds the GIL, so only another process lets the
+# receive thread go on while a block is decoded.
+#
+# decode_async() returns at once with a decode_future; a block that finds
+# every slot in use waits in this process, copied, until one is free.
+#
+# A worker always posts an outcome, None if decoding raised. One that dies
+# (RaptorDecoder can crash the process) is noticed by the collector within
+# a second: the blocks it held fail, and once no worker is left every
+# block fails and decode_async() refuses new ones.
+#
+# Within a process, decoders are taken from a decoder_pool. A RaptorDecoder
+# keeps the code of the first K it decoded: set_parameters() does not set
+# it up for another K, and a decoder given a block of another K fails or
+# crashes. The pool only hands a decoder out again for the same (K, N, T),
+# as encoder_pool does; one that failed is dropped.
+#
+
+import collections
+import multiprocessing
+import Queue
+import threading
+import numpy
+
+from block_decoder import block_decoder
+
+
+MAX_SYMBOLS = 65536             # ESIs are 16 bits on the air
+
+
+def decode_block(decoder, K, N, T, ESIs, symbols):
+    """
+    Decode one source block with the given RaptorDecoder.
+
+    Args:
+        ESIs: the ESIs of the received symbols
+        symbols: the received symbols back to back, T bytes each, in the
+                 order of ESIs (any byte buffer)
+
+    Returns the K * T decoded bytes, or None if decoding failed. A decoder
+    that failed must not be used again.
+    """
+    if any(ESIs[i] > ESIs[i + 1] for i in xrange(len(ESIs) - 1)):
+        symbols = bytearray(symbols)
+        order = sorted(xrange(len(ESIs)), key=ESIs.__getitem__)
+        symbols = ''.join(str(symbols[i * T:(i + 1) * T]) for i in order)
+        ESIs = [ESIs[i] for i in order]
+
+    lossNum = decoder.set_symbols(ESIs, symbols, T)
+    decoder.set_parameters(K, N, lossNum)
+    decoder.decode()
+    recover_symbols = []
+    while decoder.is_empty() is False:
+        recover_symbols.append(decoder.get_decodedSym())
+    if len(recover_symbols) != K:
+        return None
+    return ''.join(recover_symbols)
+
+
+class decoder_pool(object):
+    """
+    Idle RaptorDecoders by the (K, N, T) they decoded.
+
+    Args:
+        max_idle: decoders kept between blocks, 0 to build one per block
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = []              # ((K, N, T), decoder), least recently used first
+        self.lock = threading.Lock()
+        self.built = 0
+        self.reused = 0
+        self.dropped = 0
+
+    def acquire(self, K, N, T):
+        """
+        Return an idle decoder of (K, N, T), or a new one.
+        """
+        key = (K, N, T)
+        self.lock.acquire()
+        try:
+            for i in xrange(len(self.idle) - 1, -1, -1):
+                if self.idle[i][0] == key:
+                    self.reused += 1
+                    return self.idle.pop(i)[1]
+            self.built += 1
+        finally:
+            self.lock.release()
+        return block_decoder()
+
+    def release(self, decoder, K, N, T, failed=False):
+        """
+        Give back a decoder that decoded a block of (K, N, T); one that
+        failed is dropped.
+        """
+        self.lock.acquire()
+        try:
+            if failed:
+                self.dropped += 1
+            elif self.max_idle > 0:
+                self.idle.append(((K, N, T), decoder))
+                del self.idle[:-self.max_idle]
+        finally:
+            self.lock.release()
+
+    def decode(self, K, N, T, ESIs, symbols):
+        """
+        decode_block() with a decoder of the pool.
+        """
+        decoder = self.acquire(K, N, T)
+        try:
+            data = decode_block(decoder, K, N, T, ESIs, symbols)
+        except Exception, e:
+            print "decoder pool: decoding a block of K = %d raised %s" % (K, e)
+            data = None
+        self.release(decoder, K, N, T, data is None)
+        return data
+
+
+class decode_future(object):
+    """
+    Outcome of decode_async(): the decoded bytes of a block, or None if
+    it did not decode.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.finished = False
+        self.data = None
+        self.callbacks = []
+
+    def done(self):
+        return self.finished
+
+    def result(self, timeout=None):
+        """
+        Wait for the outcome, at most timeout seconds if given; raises
+        RuntimeError if it is not there by then.
+        """
+        self.cond.acquire()
+        try:
+            if not self.finished:
+                self.cond.wait(timeout)
+            if not self.finished:
+                raise RuntimeError("decoding not finished")
+            return self.data
+        finally:
+            self.cond.release()
+
+    def add_done_callback(self, fn):
+        """
+        Invoke fn(future) once the outcome is there: at once if it is,
+        else from the thread that sets it.
+        """
+        self.cond.acquire()
+        try:
+            if not self.finished:
+                self.callbacks.append(fn)
+                return
+        finally:
+            self.cond.release()
+        fn(self)
+
+    def set_result(self, data):
+        self.cond.acquire()
+        try:
+            self.data = data
+            self.finished = True
+            self.cond.notifyAll()
+            callbacks = self.callbacks
+            self.callbacks = []
+        finally:
+            self.cond.release()
+        for fn in callbacks:
+            fn(self)
+
+
+class parallel_decoder(object):
+    """
+    Pool of decoder processes fed through shared memory.
+
+    decode_async() hands a complete block to the pool and returns a
+    decode_future at once; its callbacks run in a collector thread of this
+    process. submit() does the same for callback(key, data), which gets
+    the decoded bytes, or None if the block did not decode; key is
+    whatever identifies the block to the caller, (stream, SBN) for the
+    receiver. callback may be None if only decode_async() is used.
+    """
+
+    def __init__(self, workers, slot_size, callback=None):
+        self.slot_size = slot_size
+        self.callback = callback
+        slots = 2 * workers
+
+        # allocated before the workers are forked, so they share it
+        self._data_buf = multiprocessing.RawArray('B', slots * slot_size)
+        self._esis_buf = multiprocessing.RawArray('H', slots * MAX_SYMBOLS)
+        self.data = numpy.frombuffer(self._data_buf, dtype=numpy.uint8).reshape(slots, slot_size)
+        self.esis = numpy.frombuffer(self._esis_buf, dtype=numpy.uint16).reshape(slots, MAX_SYMBOLS)
+
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)  # signalled when a block is done
+        self.free_slots = range(slots)
+        self.futures = {}                   # slot -> (task number, decode_future of its block)
+        self.waiting = collections.deque()  # blocks that found no free slot
+        self.tasks_sent = 0
+
+        # the worker decoding each slot, -1 if none
+        self._owner_buf = multiprocessing.RawArray('i', [-1] * slots)
+
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=self._worker, args=(i,))
+                        for i in xrange(workers)]
+        self.dead = set()                   # the workers that died
+        self.collector = threading.Thread(target=self._collect)
+        self.collector.daemon = True
+
+    def start(self):
+        """
+        Fork the workers. Call this before the flow graph starts its threads.
+        """
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+        self.collector.start()
+
+    def stop(self):
+        """
+        Wait for the blocks handed over so far, then stop the workers. The
+        blocks of a worker that died fail.
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                if not self.futures and not self.waiting:
+                    break
+                self.idle.wait(1.0)
+            finally:
+                self.lock.release()
+            self._reap()
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.results.put(None)
+        self.collector.join()
+
+    def decode_async(self, K, N, T, ESIs, symbols):
+        """
+        Queue a block for decoding and return its decode_future, without
+        waiting for a free slot. Returns None if the block or its decoded
+        data do not fit a slot, or if every worker has died.
+        """
+        count = len(ESIs)
+        if count > MAX_SYMBOLS or max(count, K) * T > self.slot_size:
+            return None
+
+        future = decode_future()
+        symbols = numpy.frombuffer(symbols, dtype=numpy.uint8, count=count * T)
+        self.lock.acquire()
+        try:
+            if len(self.dead) == len(self.workers):
+                return None
+            if self.free_slots:
+                self._dispatch(self.free_slots.pop(), future, K, N, T, ESIs, symbols)
+            else:
+                # the caller may go on filling its buffers
+                self.waiting.append((future, K, N, T, list(ESIs), symbols.copy()))
+        finally:
+            self.lock.release()
+        return future
+
+    def submit(self, key, K, N, T, ESIs, symbols):
+        """
+        decode_async() with callback(key, data) invoked on the outcome.
+        Returns False if decode_async() returns None.
+        """
+        future = self.decode_async(K, N, T, ESIs, symbols)
+        if future is None:
+            return False
+        future.add_done_callback(lambda future: self.callback(key, future.result()))
+        return True
+
+    def _dispatch(self, slot, future, K, N, T, ESIs, symbols):
+        # called with the lock held
+        count = len(ESIs)
+        self.esis[slot, :count] = ESIs
+        self.data[slot, :count * T] = symbols
+        self.tasks_sent += 1
+        self.futures[slot] = (self.tasks_sent, future)
+        self.tasks.put((slot, self.tasks_sent, K, N, T, count))
+
+    def _worker(self, index):
+        # decoders are reused only for blocks of the same (K, N, T)
+        pool = decoder_pool()
+        for (slot, task, K, N, T, count) in iter(self.tasks.get, None):
+            self._owner_buf[slot] = index
+            try:
+                data = pool.decode(K, N, T, self.esis[slot, :count].tolist(),
+                                   self.data[slot, :count * T])
+                if data is not None:
+                    self.data[slot, :len(data)] = numpy.frombuffer(data, dtype=numpy.uint8)
+            except Exception, e:
+                print "decoder process %d: block of K = %d failed: %s" % (index, K, e)
+                data = None
+            if data is None:
+                self.results.put((slot, task, None))
+            else:
+                self.results.put((slot, task, len(data)))
+
+    def _collect(self):
+        while True:
+            try:
+                item = self.results.get(timeout=1.0)
+            except Queue.Empty:
+                self._reap()
+                continue
+            if item is None:
+                break
+            (slot, task, result) = item
+            if result is not None:
+                result = self.data[slot, :result].tostring()
+            self._finish(slot, task, result)
+
+    def _finish(self, slot, task, result):
+        # hand the outcome of a task to its future, the slot to the next block
+        self.lock.acquire()
+        try:
+            if slot not in self.futures or self.futures[slot][0] != task:
+                # a slot already failed with its dead worker
+                return
+            future = self.futures.pop(slot)[1]
+            self._owner_buf[slot] = -1
+            if self.waiting and len(self.dead) < len(self.workers):
+                self._dispatch(slot, *self.waiting.popleft())
+            else:
+                self.free_slots.append(slot)
+            self.idle.notifyAll()
+        finally:
+            self.lock.release()
+        future.set_result(result)
+
+    def _reap(self):
+        """
+        Fail the blocks of the workers that died; once none is left, fail
+        every block.
+        """
+        self.lock.acquire()
+        try:
+            dead = [i for (i, worker) in enumerate(self.workers)
+                    if i not in self.dead and worker.exitcode is not None]
+            if not dead:
+                return
+            for i in dead:
+                print "decoder process %d died (exit code %d)" % (i, self.workers[i].exitcode)
+            self.dead.update(dead)
+            alive = len(self.dead) < len(self.workers)
+            failed = [(slot, task) for (slot, (task, future)) in self.futures.items()
+                      if not alive or self._owner_buf[slot] in dead]
+            if not alive:
+                failed.extend((None, future) for (future, K, N, T, ESIs, symbols) in self.waiting)
+                self.waiting.clear()
+        finally:
+            self.lock.release()
+        for (slot, task) in failed:
+            if slot is None:
+                task.set_result(None)
+            else:
+                self._finish(slot, task, None)
@@ -0,0 +1,221 @@
+#
+# Live playout of the received video: a reorder buffer that hands the
+# pieces (source blocks by SBN, or raw packets by pktno) over in order as
+# soon as they are contiguous, to a sink a player can read while the
+# transfer goes on:
+#
+#   -            stdout (the receiver's own messages go to stderr then)
+#   fifo:PATH    a named pipe, made if it does not exist
+#   tcp:PORT     one client on 127.0.0.1:PORT, e.g.
+#                ffplay -f h264 tcp://127.0.0.1:PORT
+#   FILE         a plain file
+#
+# A piece that is missing holds back the ones after it. With the stall
+# policy they wait until it arrives or is reported lost (a source block
+# given up, a packet dropped by -p). With skip, a missing piece is also
+# skipped once depth pieces after it are waiting; a raw receiver should
+# use skip, as it does not learn of packets lost on the air.
+#
+# The sink is opened and written by a thread of its own, so a player that
+# is late to connect or slow to read never holds up the receiver. At most
+# depth pieces wait for that thread; while the player does not keep up,
+# the oldest of them are dropped.
+#
+
+import collections
+import os, sys
+import socket
+import threading
+
+
+def take_stdout():
+    """
+    Return a file object on stdout for the video, and send everything
+    else written to stdout, by print or by GNU Radio, to stderr from now
+    on. Call it on the main thread before the flow graph starts.
+    """
+    sys.stdout.flush()
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return out
+
+
+def open_sink(spec):
+    """
+    Open the sink described by spec (see the top of this file; - is
+    take_stdout()'s) and return a file object to write the video to. May
+    block until a reader connects.
+    """
+    (kind, sep, arg) = spec.partition(':')
+    if kind == 'fifo' and sep:
+        if not os.path.exists(arg):
+            os.mkfifo(arg)
+        return open(arg, 'wb')
+    if kind == 'tcp' and sep:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('127.0.0.1', int(arg)))
+        listener.listen(1)
+        (conn, addr) = listener.accept()
+        listener.close()
+        return conn.makefile('wb')
+    return open(spec, 'wb')
+
+
+class playout_buffer(object):
+    """
+    Reorder buffer in front of a sink.
+
+    Args:
+        spec: the sink, for open_sink()
+        depth: with skip, pieces waiting behind a missing one before it is
+               skipped; pieces waiting for the sink before the oldest is dropped
+        policy: 'stall' or 'skip'
+        first: sequence number of the first piece
+        modulus: sequence numbers wrap around at this
+        out: file object already open on the sink, instead of opening spec
+    """
+
+    def __init__(self, spec, depth=8, policy='skip', first=0, modulus=0x10000, out=None):
+        self.spec = spec
+        self.out = out
+        self.depth = depth
+        self.policy = policy
+        self.next = first
+        self.modulus = modulus
+        self.held = {}                  # sequence number -> data, None if lost
+        self.ready = collections.deque()   # pieces waiting for the sink
+        self.cond = threading.Condition()
+        self.running = True
+        self.written = 0                # bytes written to the sink
+        self.skipped = 0                # pieces lost or skipped
+        self.dropped = 0                # pieces the sink did not keep up with
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def push(self, seq, data):
+        """
+        Hand over piece seq, or None if it is lost for good. Pieces that
+        were already played out or skipped are ignored.
+        """
+        self.cond.acquire()
+        try:
+            if (seq - self.next) % self.modulus >= self.modulus // 2:
+                return
+            self.held[seq] = data
+            self._advance()
+        finally:
+            self.cond.release()
+
+    def _advance(self):
+        # called with the lock held
+        moved = False
+        while self.held:
+            if self.next in self.held:
+                data = self.held.pop(self.next)
+                if data is None:
+                    self.skipped += 1
+                else:
+                    if len(self.ready) >= self.depth:
+                        self.ready.popleft()
+                        self.dropped += 1
+                    self.ready.append(data)
+            elif self.policy == 'skip' and len(self.held) >= self.depth:
+                self.skipped += 1
+            else:
+                break
+            self.next = (self.next + 1) % self.modulus
+            moved = True
+        if moved:
+            self.cond.notifyAll()
+
+    def close(self):
+        """
+        End of the transfer: play out what is held, gaps skipped, and
+        close the sink once it has been written. Waits for a FIFO or TCP
+        sink that no player has opened yet, and for room among the depth
+        pieces rather than dropping any.
+        """
+        self.cond.acquire()
+        try:
+            while self.held:
+                data = self.held.pop(self.next, None)
+                if data is None:
+                    self.skipped += 1
+                else:
+                    while len(self.ready) >= self.depth:
+                        self.cond.wait()
+                    self.ready.append(data)
+                    self.cond.notifyAll()
+                self.next = (self.next + 1) % self.modulus
+            self.running = False
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        self.thread.join()
+
+    def _run(self):
+        out = self.out
+        if out is None:
+            try:
+                out = open_sink(self.spec)
+            except EnvironmentError, e:
+                sys.stderr.write("playout: cannot open %s: %s\n" % (self.spec, e))
+
+        while True:
+            self.cond.acquire()
+            try:
+                while self.running and not self.ready:
+                    self.cond.wait()
+                if not self.ready:
+                    break
+                pieces = list(self.ready)
+                self.ready.clear()
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+
+            if out is None:
+                continue
+            try:
+                for data in pieces:
+                    out.write(data)
+                    self.written += len(data)
+                out.flush()
+            except EnvironmentError, e:
+                # the player went away; keep the receiver going
+                sys.stderr.write("playout: %s stopped: %s\n" % (self.spec, e))
+                out = None
+
+        if out is not None:
+            out.close()
+
+
+def add_options(normal, expert):
+    """
+    Adds the playout options to the Options Parser
+    """
+    normal.add_option("", "--playout", default=None,
+                      help="also play out the video in order as it arrives, to -, fifo:PATH, tcp:PORT or FILE")
+    normal.add_option("", "--playout-policy", type="choice", choices=['stall', 'skip'],
+                      default='skip',
+                      help="wait for a missing piece until it arrives or is lost (stall), or skip it after --playout-depth more (skip) [default=%default]")
+    expert.add_option("", "--playout-depth", type="intx", default=8,
+                      help="set pieces held behind a missing one before it is skipped [default=%default]")
+
+
+def make_playout(options):
+    """
+    Return the playout_buffer the options ask for, or None.
+    """
+    if options.playout is None:
+        return None
+    out = None
+    if options.playout == '-':
+        # here rather than on the playout thread, before anything else
+        # is printed or started
+        out = take_stdout()
+    return playout_buffer(options.playout, options.playout_depth, options.playout_policy,
+                          out=out)
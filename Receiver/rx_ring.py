@@ -0,0 +1,140 @@
+#
+# Hand-off of the received packets from the PHY thread to a FEC worker.
+#
+# put() is all that runs on the thread GNU Radio delivers the packets on:
+# it appends the payload to a bounded ring and wakes the worker, or counts
+# it dropped if the ring is full, and never waits for the worker. The
+# worker takes the packets out in batches of up to batch and hands each to
+# the handler: unpacking, loss emulation, decoding.
+#
+# The ring is a deque, whose append() and popleft() are atomic, so the two
+# threads share no lock over it.
+#
+# Three stages are timed, per packet: enqueue (put() on the PHY thread),
+# wait (in the ring) and handle (by the handler).
+#
+
+import collections
+import threading
+import time
+
+
+class stage_time(object):
+    """
+    Count, total and maximum of the durations of one stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def __str__(self):
+        mean = self.total / self.count if self.count else 0.0
+        return "%.3f ms mean, %.3f ms max" % (mean * 1e3, self.max * 1e3)
+
+
+class rx_ring(object):
+    """
+    Bounded ring of received packets and the worker that drains it.
+
+    Args:
+        handler: handler(ok, payload), invoked from the worker for each packet
+        size: packets the ring holds; more are dropped
+        batch: packets the worker takes out at a time
+    """
+
+    def __init__(self, handler, size=1024, batch=32):
+        self.handler = handler
+        self.size = size
+        self.batch = batch
+        self.ring = collections.deque()
+        self.wakeup = threading.Event()
+        self.idle = threading.Condition()   # signalled when the ring is drained
+        self.busy = False
+        self.running = True
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.enqueue = stage_time()
+        self.wait = stage_time()
+        self.handle = stage_time()
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, ok, payload):
+        """
+        Queue a packet for the worker; the phy_rx_callback of the PHY.
+        Returns False if the ring was full and the packet is dropped.
+        """
+        arrival = time.time()
+        depth = len(self.ring)
+        if depth >= self.size:
+            self.dropped += 1
+            return False
+        self.ring.append((arrival, ok, payload))
+        if depth >= self.max_depth:
+            self.max_depth = depth + 1
+        self.enqueued += 1
+        self.wakeup.set()
+        self.enqueue.add(time.time() - arrival)
+        return True
+
+    def depth(self):
+        return len(self.ring)
+
+    def flush(self):
+        """
+        Wait until the worker has handled every packet queued so far.
+        """
+        self.idle.acquire()
+        try:
+            while self.ring or self.busy:
+                self.idle.wait(0.1)
+        finally:
+            self.idle.release()
+
+    def stop(self):
+        """
+        Handle what is left in the ring and stop the worker.
+        """
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+
+    def report(self):
+        return ("rx ring:        %d packets, %d dropped, depth %d of %d at most\n"
+                "                enqueue %s; wait %s; handle %s" % (
+                    self.enqueued, self.dropped, self.max_depth, self.size,
+                    self.enqueue, self.wait, self.handle))
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.busy = True
+            while self.ring:
+                start = time.time()
+                for i in xrange(min(self.batch, len(self.ring))):
+                    (arrival, ok, payload) = self.ring.popleft()
+                    self.wait.add(start - arrival)
+                    self.handler(ok, payload)
+                    now = time.time()
+                    self.handle.add(now - start)
+                    start = now
+
+            self.idle.acquire()
+            self.busy = False
+            self.idle.notifyAll()
+            self.idle.release()
+            if not self.running and not self.ring:
+                break
@@ -48,9 +48,17 @@ from uhd_interface import uhd_receiver
 
 from raptor_decoder import *
 import raptor_decoder
+from parallel_decoder import parallel_decoder, decoder_pool
+from rx_ring import rx_ring
+from block_table import block_state, block_table
+from loss_mask import loss_mask
+from raptor_packet import ACK_DECODED
+import raptor_packet
+import playout
 
 import os, sys
 import random, time, struct
+import threading
 import numpy
 
 #print os.getpid()
@@ -141,8 +149,8 @@ class my_top_block(gr.top_block):
 #                           Carrier Sense MAC
 # ////////////////////////////////////////////////////////////////////
 
-isDecSuccess = False
-isFirstPkt = True
+# The packet and ACK layouts are in raptor_packet.py, shared with the
+# sender.
 
 class cs_mac(object):
     """
@@ -156,72 +164,126 @@ class cs_mac(object):
     this is just an example.
     """
 
-    def __init__(self, PLR, received_file, verbose=False):
+    def __init__(self, PLR, received_file, verbose=False,
+                 overhead=2, retry_step=2, block_timeout=5.0, ack_interval=0.1,
+                 loss_seed=0, loss_burst=1.0, idle_decoders=4):
         #self.tun_fd = tun_fd       # file descriptor for TUN/TAP interface
         self.received_file = received_file
         self.PLR = PLR
+        self.loss = loss_mask(PLR, loss_seed, loss_burst)
         self.verbose = verbose
         self.tb = None             # top block (access to PHY)
-        self.decoder = raptor_decoder.RaptorDecoder()
-        self.lossDataIndex = []
+        self.decoders = None       # pool of decoder processes, if any
+        self.ring = None           # rx_ring the PHY hands the packets to, if any
+        self.playout = None        # playout_buffer of one stream, if any
+        self.playoutStream = 0
+        self.decoder_pool = decoder_pool(idle_decoders)
+        self.blocks = block_table()    # (stream, SBN) -> block_state
+        self.lock = threading.RLock()
+        # signalled when there is an ACK to send or a timeout to rearm
+        self.cond = threading.Condition(self.lock)
+
+        # decode trigger: first attempt once K + overhead symbols are in,
+        # after a failure again every retry_step new symbols, and give up
+        # on a block that got no symbol for block_timeout seconds.
+        self.overhead = overhead
+        self.retry_step = retry_step
+        self.block_timeout = block_timeout
+
+        # (stream, SBN) of the blocks waiting to be acknowledged. A block
+        # that keeps receiving symbols after it was acknowledged is
+        # acknowledged again, at most every ack_interval seconds.
+        self.pendingAcks = []
+        self.ack_interval = ack_interval
+        self.running = False
+
+    def add_options(normal, expert):
+        """
+        Adds MAC-specific options to the Options Parser
+        """
+        # WYQ
+        normal.add_option("-p", "--PLR", type="intx", default=3,
+                          help="set packet loss rate [default=%default]")
+        normal.add_option("", "--loss-seed", type="intx", default=0,
+                          help="set seed of the packets lost with -p [default=%default]")
+        normal.add_option("", "--loss-burst", type="eng_float", default=1.0,
+                          help="set mean length of the runs of packets lost with -p [default=%default]")
+        normal.add_option("", "--overhead", type="intx", default=2,
+                          help="set symbols beyond K before the first decoding attempt [default=%default]")
+        normal.add_option("", "--retry-step", type="intx", default=2,
+                          help="set new symbols between decoding attempts after a failure [default=%default]")
+        normal.add_option("", "--block-timeout", type="eng_float", default=5.0,
+                          help="set idle seconds before a source block is given up [default=%default]")
+        normal.add_option("", "--ack-interval", type="eng_float", default=0.1,
+                          help="set seconds between repeated ACKs of a decoded block [default=%default]")
+        normal.add_option("", "--decoders", type="intx", default=0,
+                          help="set decoder processes, 0 decodes in the receive thread [default=%default]")
+        expert.add_option("", "--rx-ring", type="intx", default=1024,
+                          help="set packets queued between the PHY thread and the FEC worker, 0 handles them on the PHY thread [default=%default]")
+        expert.add_option("", "--rx-batch", type="intx", default=32,
+                          help="set packets the FEC worker takes from the --rx-ring at a time [default=%default]")
+        expert.add_option("", "--idle-decoders", type="intx", default=4,
+                          help="set decoders kept for the next blocks, 0 sets one up per attempt [default=%default]")
+        expert.add_option("", "--slot-size", type="intx", default=1 << 20,
+                          help="set shared memory bytes per block handed to the decoders [default=%default]")
+    # Make a static method to call before instantiation
+    add_options = staticmethod(add_options)
 
     def set_top_block(self, tb):
         self.tb = tb
 
-    def pack_pkt(self, SBN, ESI, K, N, T, symbols):
+    def set_decoders(self, decoders):
+        self.decoders = decoders
+
+    def set_rx_ring(self, ring):
+        """
+        Have phy_rx_callback() only queue the packets on ring, whose
+        worker passes them to handle_packet().
+        """
+        self.ring = ring
+
+    def set_playout(self, playout, stream=0):
+        """
+        Also hand the decoded source blocks of stream to playout, by SBN.
+        """
+        self.playout = playout
+        self.playoutStream = stream
+
+    def pack_pkt(self, stream, SBN, ESI, K, N, T, offset, size, symbols):
 
-        # build the packet to be sent. packet = pktno + pkt + crc32
+        # build the packet to be sent. packet = header + symbols
+        #   - version: the wire format version (PKT_VERSION)
+        #   - stream: the id of the sender
         #   - SBN:   source block number of raptor codes
         #   - ESI:   the id of encoded symbols
         #   - K: the number of source symbols
         #   - N: the number of encoded symbols
         #   - T: the length of the source/encoded symbols
-        
-        def hexint(mask):
-            if mask >= 2**31:
-                return int(mask-2**32)
-            return mask
-
-        trunk = ''
-        for symbol in symbols:
-            trunk += struct.pack('!H', symbol & 0xffff)
+        #   - offset: the byte offset of the source block in the file
+        #   - size: the length of the source block without padding
+        # the T bytes of the encoded symbol follow the header as they are.
+
         print "[pack_pkt] SBN: %d  ESI: %d, K: %d, N: %d, T: %d" % (SBN, ESI, K, N, T)
-        return (struct.pack('!H', SBN & 0xffff) + struct.pack('!H', ESI & 0xffff) + struct.pack('!H', K & 0xffff) 
-         + struct.pack('!H', N & 0xffff) + struct.pack('!H', T & 0xffff) + trunk)
+        return raptor_packet.pack_pkt(stream, SBN, ESI, K, N, T, offset, size, symbols)
 
     def unpack_pkt(self, payload):
-        if len(payload) < 12:
-            return (False, None, None, None)
-        
-        pkt_ok = True
+        unpacked = raptor_packet.unpack_pkt(payload)
+        print "[unpack_pkt] pkt_ok: %r" % (unpacked[0])
+        return unpacked
 
-        (SBN,) = struct.unpack('!H', payload[0:2])
-        (ESI,) = struct.unpack('!H', payload[2:4])
-        (K,) = struct.unpack('!H', payload[4:6])
-        (N,) = struct.unpack('!H', payload[6:8])
-        (T,) = struct.unpack('!H', payload[8:10])
-        pkt = payload[10:]
-
-        symbols = list()
-
-        for pos in xrange(0, len(pkt), 2):
-            symbols.append(struct.unpack('!H', pkt[pos:pos+2])[0])
-
-        print "[unpack_pkt] pkt_ok: %r" % (pkt_ok)
-        #print "[unpack_pkt] pkt_ok: %r, SBN: %d  ESI: %d, K: %d, T: %d" % (pkt_ok, SBN, ESI, K, T)
-        return (pkt_ok, SBN, ESI, K, N, T, symbols)
-    
-    def pack_ack(self, pktno = None):
-        if pktno is None:
-            pktno = 1
+    def unpack_frame(self, payload):
+        """
+        Return the unpack_pkt() tuples of the symbols of a packet: of
+        every symbol of an aggregated packet, else of its one symbol.
+        """
+        return raptor_packet.unpack_frame(payload)
 
-        return struct.pack('!H', pktno & 0xffff)
+    def pack_ack(self, stream, SBN, flags=ACK_DECODED, sent=0, received=0, used=0):
+        return raptor_packet.pack_ack(stream, SBN, flags, sent, received, used)
 
     def unpack_ack(self, ack):
-        if len(ack) != 2:
-            return (None, None)
-
-        return struct.unpack('!H', ack)
+        # returns (stream, SBN, flags, sent, received, used), or None
+        return raptor_packet.unpack_ack(ack)
 
     def phy_rx_callback(self, ok, payload):
         """
@@ -231,9 +293,16 @@ class cs_mac(object):
             ok: bool indicating whether payload CRC was OK
             payload: contents of the packet (string)
         """
-        global isDecSuccess
-        global isFirstPkt
+        if self.ring is not None:
+            self.ring.put(ok, payload)
+        else:
+            self.handle_packet(ok, payload)
 
+    def handle_packet(self, ok, payload):
+        """
+        Take in a received packet: unpack its symbols, one or more, and
+        hand each to handle_symbol().
+        """
         #rndValue = random.randint(0, 99)
         #if rndValue < self.PLR:
         #    print "This packet is discarded due to error!"
@@ -246,86 +315,218 @@ class cs_mac(object):
         #if ok:
         #    os.write(self.tun_fd, payload)
 
-        (pkt_ok, SBN, ESI, K, N, T, symbols) = self.unpack_pkt(payload)
-        
-        if isFirstPkt is True:
-            lossNum = K * self.PLR // 100
-            self.decoder.set_parameters(K, N, lossNum)
-            isFirstPkt = False
-
-            #lossDataIndex.append(random.randint(0, N))
-            lossIndex = 0
-            while lossIndex < lossNum:
-                rndValue = random.randint(1, N - 1)
-                if rndValue not in self.lossDataIndex:
-                    self.lossDataIndex.append(rndValue)
-                    lossIndex += 1
-
-            self.lossDataIndex.sort()
-
-        if ESI not in self.lossDataIndex:
-            self.decoder.set_ESI(ESI)
-        else:
-            print "lost packet number: %d" % ESI
-      
-        #print symbols
-        #print len(symbols)
-        i = 0
-        receive_symbols = raptor_decoder.vectoruc()
-        while i < T:
-            if symbols[i] > 255:
-                 symbols[i] = 255
-            receive_symbols.append(symbols[i])
-            i += 1
-
-        self.decoder.set_data(receive_symbols)
-        receive_symbols.clear()
-        #del receive_symbols
-
-        #ESI is equal to N means that receives all encoded symbols
-        if ESI == (N - 2):
-            self.decoder.decode()
-            while self.decoder.is_empty() is False:
-                recover_symbols = raptor_decoder.vectoruc()
-                recover_symbols = self.decoder.get_decodedSym()
-                #decodeOut = list(recover_symbols)
-                #print recover_symbols
-                #print "\n"
-                self.received_file.write(recover_symbols)
-            isDecSuccess = True
-            print "Decode done!"
+        for (pkt_ok, stream, SBN, ESI, K, N, T, offset, size, symbols) in self.unpack_frame(payload):
+            if not pkt_ok:
+                print "Oops! malformed raptor packet, len(payload) = %d" % len(payload)
+                return
+            self.handle_symbol(stream, SBN, ESI, K, N, T, offset, size, symbols)
+
+    def handle_symbol(self, stream, SBN, ESI, K, N, T, offset, size, symbols):
+        """
+        Emulate the loss of a received symbol, add it to its source block
+        and start a decoding attempt if it is time for one.
+        """
+        key = (stream, SBN)
+        self.lock.acquire()
+        try:
+            now = time.time()
+            block = self.blocks.get(key)
+            if block is None:
+                # first packet of this source block
+                block = block_state(K, N, T, offset, size, K + self.overhead, now)
+                self.blocks.add(key, block)
+                block.lossMask = self.loss.block(key, K, N)
+                # main_loop may be waiting without a deadline
+                self.cond.notify()
+
+            if block.decoded:
+                # the sender is still on this block: our ACK got lost
+                if now - block.ackTime >= self.ack_interval:
+                    self.send_ack(key, block, now)
+            elif not block.done:
+                block.lastTime = now
+                block.sent = max(block.sent, ESI + 1)
+                # a rateless sender goes on beyond the N of its first packets
+                block.N = max(block.N, N)
+                if ESI >= len(block.lossMask):
+                    block.lossMask = self.loss.extend(key, block.lossMask, ESI)
+                if block.lossMask[ESI]:
+                    print "lost packet number: %d of block %d" % (ESI, SBN)
+                elif not block.add_symbol(ESI, symbols):
+                    return
+
+                # the last ESI also triggers an attempt, as no more symbols follow
+                count = block.count()
+                if not block.pending and (count >= block.nextAttempt or
+                                          (ESI == N - 1 and count >= K)):
+                    self.decode(key, block)
+        finally:
+            self.lock.release()
+
+    def check_timeouts(self, now):
+        """
+        Finalize the blocks that have not received a symbol for
+        block_timeout seconds: one last attempt with whatever arrived
+        since the previous one, then the block is given up.
 
+        Returns the time the next open block times out, or None.
+        """
+        deadline = None
+        self.lock.acquire()
+        try:
+            for (key, block) in self.blocks.open_items():
+                if block.pending or block.final:
+                    continue
+                if now - block.lastTime < self.block_timeout:
+                    if deadline is None or block.lastTime + self.block_timeout < deadline:
+                        deadline = block.lastTime + self.block_timeout
+                    continue
+                block.final = True
+                count = block.count()
+                if count >= block.K and count > block.attempted:
+                    self.decode(key, block)
+                else:
+                    self.block_decoded(key, None)
+        finally:
+            self.lock.release()
+        return deadline
+
+    def stop(self):
+        """
+        Make main_loop return.
+        """
+        self.cond.acquire()
+        self.running = False
+        self.cond.notify()
+        self.cond.release()
+
+    def send_ack(self, key, block, now):
+        """
+        Queue the ACK of a decoded or given up block for main_loop to send.
+        The loss report is taken the first time, while the block still
+        holds its symbols. Called with the lock held.
+        """
+        if block.report is None:
+            flags = ACK_DECODED if block.decoded else 0
+            block.report = (flags, block.sent, block.count(), block.attempted)
+        block.ackTime = now
+        self.pendingAcks.append(key + block.report)
+        self.cond.notify()
+
+    def decode(self, key, block):
+        """
+        Start a decoding attempt of a source block, in the decoder processes
+        if there are any. The result comes back through block_decoded().
+        """
+        block.pending = True
+        block.attempted = block.count()
+        (K, N, T) = (block.K, block.N, block.T)
+        if self.decoders is not None and self.decoders.submit(key, K, N, T,
+                                                              block.ESIs, block.symbols):
+            return
+
+        data = self.decoder_pool.decode(K, N, T, block.ESIs, block.symbols)
+        self.block_decoded(key, data)
+
+    def block_decoded(self, key, data):
+        """
+        Invoked with the decoded bytes of a source block, or None if the
+        attempt failed. A failed block is retried once retry_step more
+        symbols have arrived, unless it has been finalized. The retry is
+        left to the next arrival; this may run in the collector thread of
+        the decoder pool.
+        """
+        (stream, SBN) = key
+        self.lock.acquire()
+        try:
+            block = self.blocks[key]
+            block.pending = False
+            if data is None:
+                if not block.final:
+                    block.nextAttempt = block.attempted + self.retry_step
+                    print "Decode failed with %d symbols, will retry! block %d" % (
+                        block.attempted, SBN)
+                    # the block can time out again
+                    self.cond.notify()
+                    return
+                print "Decode failed! block %d" % SBN
+                # tell the sender its repair symbols were not enough
+                self.send_ack(key, block, time.time())
+                if self.playout is not None and stream == self.playoutStream:
+                    self.playout.push(SBN, None)
+            else:
+                self.received_file.seek(block.offset)
+                self.received_file.write(data[:block.size])
+                if self.playout is not None and stream == self.playoutStream:
+                    self.playout.push(SBN, data[:block.size])
+                block.decoded = True
+                self.send_ack(key, block, time.time())
+                print "Decode done with %d symbols! block %d" % (block.attempted, SBN)
+
+            self.blocks.close(key)
+        finally:
+            self.lock.release()
 
     def main_loop(self):
         """
         Main loop for MAC.
-        Only returns if we get an error reading from TUN.
+        Only returns if we get an error reading from TUN, or after stop().
 
         FIXME: may want to check for EINTR and EAGAIN and reissue read
+
+        Sleeps until a block is decoded or given up, or until the next
+        open block may time out.
         """
         min_delay = 0.001               # seconds
 
-        while 1:
-            #payload = os.read(self.tun_fd, 10*1024)
-            #if not payload:
-            #    self.tb.send_pkt(eof=True)
-            #    break
-
-            while not isDecSuccess:       # before decoding success, sending routine spins here.
-                time.sleep(min_delay / 100)
-            
-            '''
-                the ACK msg's layout shown below:
-                    +-------------------+
-                    | tries |    crc    |
-                    +-------------------+
-                tries:
-                    pkts used to successfully decode the original message.
-                crc:
-                    crc value of the original message.
-            '''
-            packet = self.pack_ack()
+        self.cond.acquire()
+        self.running = True
+        try:
+            while self.running:
+                #payload = os.read(self.tun_fd, 10*1024)
+                #if not payload:
+                #    self.tb.send_pkt(eof=True)
+                #    break
+
+                # the last blocks time out without any packet arriving
+                now = time.time()
+                deadline = self.check_timeouts(now)
+                if not self.pendingAcks:
+                    self.cond.wait(deadline and max(deadline - now, min_delay))
+                    continue
+
+                acks = self.pendingAcks
+                self.pendingAcks = []
+                self.cond.release()
+                try:
+                    self.send_acks(acks)
+                finally:
+                    self.cond.acquire()
+        finally:
+            self.cond.release()
+
+    def send_acks(self, acks):
+        """
+        Send the ACKs queued by send_ack().
+        """
+        min_delay = 0.001               # seconds
 
+        '''
+            the ACK msg's layout shown below:
+                +--------+-----+-------+------+----------+------+
+                | stream | SBN | flags | sent | received | used |
+                +--------+-----+-------+------+----------+------+
+            stream, SBN:
+                the source block that has been decoded or given up.
+            flags:
+                ACK_DECODED if it has been decoded.
+            sent, received:
+                symbols of the block sent and received by then.
+            used:
+                symbols the last decoding attempt used.
+        '''
+        for ack in acks:
+            packet = self.pack_ack(*ack)
 
             if self.verbose:
                 i = 1
@@ -342,7 +543,6 @@ class cs_mac(object):
             self.tb.txpath.send_pkt(packet)
 
 
-
 # /////////////////////////////////////////////////////////////////////////////
 #                                   main
 # /////////////////////////////////////////////////////////////////////////////
@@ -362,9 +562,9 @@ def main():
     parser.add_option("-s", "--size", type="eng_float", default=1500,
                       help="set packet size [default=%default]")
     parser.add_option("-v","--verbose", action="store_true", default=False)
-    # WYQ
-    parser.add_option("-p", "--PLR", type="intx", default=3,
-                      help="set packet loss rate [default=%default]")
+
+    cs_mac.add_options(parser, expert_grp)
+    playout.add_options(parser, expert_grp)
 
     expert_grp.add_option("-c", "--carrier-threshold", type="eng_float", default=30,
                           help="set carrier detect threshold (dB) [default=%default]")
@@ -407,7 +607,22 @@ def main():
 
     # instantiate the MAC
     #mac = cs_mac(tun_fd, verbose=True)
-    mac = cs_mac(options.PLR, received_file, verbose=True)
+    mac = cs_mac(options.PLR, received_file, verbose=True,
+                 overhead=options.overhead, retry_step=options.retry_step,
+                 block_timeout=options.block_timeout, ack_interval=options.ack_interval,
+                 loss_seed=options.loss_seed, loss_burst=options.loss_burst,
+                 idle_decoders=options.idle_decoders)
+
+    # fork the decoder processes before any flow graph thread exists
+    decoders = None
+    if options.decoders > 0:
+        decoders = parallel_decoder(options.decoders, options.slot_size, mac.block_decoded)
+        decoders.start()
+        mac.set_decoders(decoders)
+    ring = None
+    if options.rx_ring > 0:
+        ring = rx_ring(mac.handle_packet, options.rx_ring, options.rx_batch)
+        mac.set_rx_ring(ring)
 
     # build the graph (PHY)
     tb = my_top_block(mods[options.modulation],
@@ -416,6 +631,9 @@ def main():
                       options)
 
     mac.set_top_block(tb)    # give the MAC a handle for the PHY
+    player = playout.make_playout(options)
+    if player is not None:
+        mac.set_playout(player)
 
     if tb.txpath.bitrate() != tb.rxpath.bitrate():
         print "WARNING: Transmit bitrate = %sb/sec, Receive bitrate = %sb/sec" % (
@@ -446,6 +664,13 @@ def main():
 
     tb.stop()     # but if it does, tell flow graph to stop.
     tb.wait()     # wait for it to finish
+    if ring is not None:
+        ring.stop()
+        print ring.report()
+    if decoders is not None:
+        decoders.stop()
+    if player is not None:
+        player.close()
     received_file.close()
                 
 
@@ -45,6 +45,8 @@ from receive_path  import receive_path
 from transmit_path import transmit_path
 from uhd_interface import uhd_transmitter
 from uhd_interface import uhd_receiver
+from loss_mask import loss_mask
+import playout
 
 import os, sys
 import random, time, struct
@@ -138,9 +140,6 @@ class my_top_block(gr.top_block):
 #                           Carrier Sense MAC
 # ////////////////////////////////////////////////////////////////////
 
-isDecSuccess = False
-prevCrc32 = None
-
 class cs_mac(object):
     """
     Prototype carrier sense MAC
@@ -153,16 +152,38 @@ class cs_mac(object):
     this is just an example.
     """
 
-    def __init__(self, PLR, received_file, verbose=False):
+    def __init__(self, PLR, received_file, verbose=False, loss_seed=0, loss_burst=1.0):
         #self.tun_fd = tun_fd       # file descriptor for TUN/TAP interface
         self.received_file = received_file
         self.PLR = PLR
+        self.loss = loss_mask(PLR, loss_seed, loss_burst)
         self.verbose = verbose
         self.tb = None             # top block (access to PHY)
+        self.playout = None        # playout_buffer, if any
+
+    def add_options(normal, expert):
+        """
+        Adds MAC-specific options to the Options Parser
+        """
+        # WYQ
+        normal.add_option("-p", "--PLR", type="intx", default=3,
+                          help="set packet loss rate [default=%default]")
+        normal.add_option("", "--loss-seed", type="intx", default=0,
+                          help="set seed of the packets lost with -p [default=%default]")
+        normal.add_option("", "--loss-burst", type="eng_float", default=1.0,
+                          help="set mean length of the runs of packets lost with -p [default=%default]")
+    # Make a static method to call before instantiation
+    add_options = staticmethod(add_options)
 
     def set_top_block(self, tb):
         self.tb = tb
 
+    def set_playout(self, playout):
+        """
+        Also hand the received packets to playout, by pktno.
+        """
+        self.playout = playout
+
     def phy_rx_callback(self, ok, payload):
         """
         Invoked by thread associated with PHY to pass received packet up.
@@ -172,9 +193,11 @@ class cs_mac(object):
             payload: contents of the packet (string)
         """
 
-        rndValue = random.randint(0, 99)
-        if rndValue < self.PLR:
+        (pktno,) = struct.unpack('!H', payload[0:2])
+        if self.loss.packet_lost(pktno):
             print "This packet is discarded due to error!"
+            if self.playout is not None:
+                self.playout.push(pktno, None)
             return
 
         if self.verbose:
@@ -182,9 +205,10 @@ class cs_mac(object):
             #print "Rx: ok = %r  len(payload) = %4d" % (ok, len(payload) - 2)
             #print "payload = 0x%s" % ''.join(x.encode('hex') for x in payload)
 
-        (pktno,) = struct.unpack('!H', payload[0:2])
         #print "packet number: %4d" % pktno
         self.received_file.write(payload[2:])
+        if self.playout is not None:
+            self.playout.push(pktno, payload[2:])
 
 
 # /////////////////////////////////////////////////////////////////////////////
@@ -206,10 +230,9 @@ def main():
     parser.add_option("-s", "--size", type="eng_float", default=1500,
                       help="set packet size [default=%default]")
     parser.add_option("-v","--verbose", action="store_true", default=False)
-    # WYQ
-    parser.add_option("-p", "--PLR", type="intx", default=3,
-                      help="set packet loss rate [default=%default]")
 
+    cs_mac.add_options(parser, expert_grp)
+    playout.add_options(parser, expert_grp)
 
     expert_grp.add_option("-c", "--carrier-threshold", type="eng_float", default=30,
                           help="set carrier detect threshold (dB) [default=%default]")
@@ -252,7 +275,8 @@ def main():
 
     # instantiate the MAC
     #mac = cs_mac(tun_fd, verbose=True)
-    mac = cs_mac(options.PLR, received_file, verbose=True)
+    mac = cs_mac(options.PLR, received_file, verbose=True,
+                 loss_seed=options.loss_seed, loss_burst=options.loss_burst)
 
     # build the graph (PHY)
     tb = my_top_block(mods[options.modulation],
@@ -261,6 +285,9 @@ def main():
                       options)
 
     mac.set_top_block(tb)    # give the MAC a handle for the PHY
+    player = playout.make_playout(options)
+    if player is not None:
+        mac.set_playout(player)
 
     if tb.txpath.bitrate() != tb.rxpath.bitrate():
         print "WARNING: Transmit bitrate = %sb/sec, Receive bitrate = %sb/sec" % (
@@ -291,6 +318,8 @@ def main():
 
     #tb.stop()     # but if it does, tell flow graph to stop.
     tb.wait()     # wait for it to finish
+    if player is not None:
+        player.close()
     received_file.close()
                 
 
@@ -0,0 +1,47 @@
+#
+# Backpressure from the transmit queue of the PHY.
+#
+# send_pkt() puts a packet in the message queue of mod_pkts and returns;
+# the modulator takes the packets from there as fast as the PHY bitrate
+# allows. Instead of guessing that rate, the sender can watch the queue:
+# it hands packets over until high of them are waiting, then waits until
+# no more than low are left. The modulator is never left without a packet
+# as long as low > 0, and no packet waits behind more than high others.
+#
+# transmit_path gives mod_pkts a queue of 4 packets, and send_pkt() blocks
+# once it is full; high is at most that.
+#
+
+import time
+
+
+class tx_backpressure(object):
+    """
+    High and low water marks on the packets queued in the PHY.
+
+    Args:
+        depth: function returning the packets queued, e.g. tb.tx_queue_depth
+        high: packets queued before the sender waits
+        low: packets left in the queue when it goes on
+        poll: seconds between looks at the queue while waiting
+    """
+
+    def __init__(self, depth, high=4, low=1, poll=0.0005):
+        self.depth = depth
+        self.high = max(high, 1)
+        self.low = min(max(low, 0), self.high - 1)
+        self.poll = poll
+        self.stalls = 0             # times the queue reached high
+        self.waited = 0.0           # seconds spent waiting for low
+
+    def wait(self):
+        """
+        Return once another packet may be handed to the PHY.
+        """
+        if self.depth() < self.high:
+            return
+        self.stalls += 1
+        start = time.time()
+        while self.depth() > self.low:
+            time.sleep(self.poll)
+        self.waited += time.time() - start
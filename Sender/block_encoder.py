@@ -0,0 +1,40 @@
+#
+# Whole-block helpers around the RaptorEncoder of the SWIG-generated
+# raptor_encoder.py, which swig writes anew on every build: they live
+# here so that the generated wrapper is left as it is.
+#
+
+# from current dir
+import raptor_encoder
+
+
+class block_encoder(raptor_encoder.RaptorEncoder):
+    """
+    RaptorEncoder(K, repairNum, 20) that takes and gives whole blocks.
+    """
+
+    def set_block(self, data, T):
+        """
+        set_data() for a whole source block. data is any byte buffer
+        holding the source symbols back to back, T bytes each; a short
+        last symbol is padded with zeros. Returns the number of symbols.
+        A str or a buffer() is sliced as it is, one symbol at a time.
+        """
+        if not isinstance(data, (str, buffer)):
+            data = str(bytearray(data))
+        if len(data) % T:
+            data += '\0' * (T - len(data) % T)
+        for pos in xrange(0, len(data), T):
+            self.set_data(data[pos:pos + T])
+        return len(data) // T
+
+    def get_encodedBlock(self):
+        """
+        Drain the encoded symbols into one contiguous bytearray, in ESI
+        order, T bytes each; numpy.frombuffer(block, numpy.uint8) and
+        reshape(N, T) give the N x T view without another copy.
+        """
+        symbols = []
+        while not self.is_empty():
+            symbols.append(bytearray(self.get_encodedSym()))
+        return bytearray().join(symbols)
@@ -0,0 +1,204 @@
+#
+# Cache of the generator matrices of the Raptor code, in memory and on
+# disk, so that a source block can be encoded without setting up a
+# RaptorEncoder for it.
+#
+# The code is linear over GF(2), bitwise alike for every byte of a
+# symbol: encoded symbol ESI is the XOR of a set of source symbols that
+# depends on K and the ESI only, not on T nor on the repair count. One
+# encoding of a probe block with T = ceil(K / 8), whose source symbol i
+# is bit i of the symbol, gives all of these sets at once: the rows of an
+# N x K bit matrix, eight source symbols to a byte. The rows are kept per
+# K, at least 2 * K of them or as many as the largest N asked for; more
+# ESIs probe again.
+#
+# Blocks are then encoded with numpy eight source symbols at a time: the
+# 256 XORs of each group of eight are tabled, and every encoded symbol
+# takes one row of each table.
+#
+# The matrices are stored in a directory, one K%d.npy per K, under a
+# subdirectory named after the SHA-1 of the _raptor_encoder module, so
+# that a rebuilt codec does not pick up the matrices of the old one; the
+# least recently used are removed beyond max_entries. The first block of
+# a K encoded with a matrix, whether just probed, grown to more rows or
+# read from disk, is encoded by RaptorEncoder and compared with the
+# matrix; blocks of any N up to the largest checked need no other check,
+# so that an N changing from block to block is not encoded twice. If
+# they differ, K is probed again; if they still differ, that K is left
+# to RaptorEncoder.
+#
+# Only the encoder side is cached: RaptorDecoder gives no access to its
+# structure, and the rows a block is decoded from change with every loss
+# pattern.
+#
+
+import collections
+import hashlib
+import os
+import threading
+
+import numpy
+
+# from current dir
+import _raptor_encoder
+from block_encoder import block_encoder
+
+
+def codec_version():
+    """
+    Return the SHA-1 of the _raptor_encoder module loaded, in hex.
+    """
+    path = _raptor_encoder.__file__
+    if path.endswith('.pyc'):
+        path = path[:-1]
+    f = open(path, 'rb')
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
+class code_cache(object):
+    """
+    Generator matrices by K, and the encoding of source blocks with them.
+
+    Args:
+        path: directory of the stored matrices, None to keep them in memory
+              only; they go in a subdirectory of it per codec_version()
+        max_entries: matrices kept in memory and on disk
+    """
+
+    def __init__(self, path=None, max_entries=16):
+        if path is not None:
+            path = os.path.join(path, codec_version()[:12])
+        self.path = path
+        self.max_entries = max_entries
+        self.matrices = collections.OrderedDict()   # K -> N x ceil(K/8) uint8, LRU first
+        self.verified = {}                          # K -> rows checked against RaptorEncoder
+        self.broken = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.checks = 0
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+
+    def filename(self, K):
+        return os.path.join(self.path, 'K%d.npy' % K)
+
+    def probe(self, K, N):
+        """
+        Return the first N rows of the generator matrix of K, from an
+        encoding of the probe block.
+        """
+        width = (K + 7) // 8
+        probe = numpy.zeros((K, width), dtype=numpy.uint8)
+        index = numpy.arange(K)
+        probe[index, index // 8] = 1 << (index % 8)
+
+        encoder = block_encoder(K, N - K, 20)
+        encoder.set_block(probe.tostring(), width)
+        encoder.get_data_access()
+        count = encoder.count_encodedSym()
+        rows = numpy.frombuffer(encoder.get_encodedBlock(), dtype=numpy.uint8)
+        return rows.reshape(count, width)
+
+    def rows(self, K, N, reprobe=False):
+        """
+        Return at least N rows of the generator matrix of K; with reprobe,
+        the ones kept are thrown away and probed again.
+        """
+        self.lock.acquire()
+        try:
+            kept = self.matrices.pop(K, None)
+            rows = kept
+            if reprobe:
+                rows = None
+            elif rows is None and self.path is not None and os.path.exists(self.filename(K)):
+                try:
+                    rows = numpy.load(self.filename(K))
+                    # mark it recently used
+                    os.utime(self.filename(K), None)
+                except (EnvironmentError, ValueError):
+                    rows = None
+            if rows is not None and len(rows) >= N:
+                self.hits += 1
+            else:
+                self.misses += 1
+                # room for the N of the next blocks to grow
+                rows = self.probe(K, max(N, 2 * K))
+                self.store(K, rows)
+            if rows is not kept:
+                # not the matrix checked so far: check it again
+                self.verified.pop(K, None)
+            self.matrices[K] = rows
+            while len(self.matrices) > self.max_entries:
+                self.matrices.popitem(last=False)
+            return rows
+        finally:
+            self.lock.release()
+
+    def store(self, K, rows):
+        if self.path is None:
+            return
+        try:
+            tmp = self.filename(K) + '.tmp'
+            f = open(tmp, 'wb')
+            numpy.save(f, rows)
+            f.close()
+            os.rename(tmp, self.filename(K))
+
+            stored = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.startswith('K') and name.endswith('.npy')]
+            stored.sort(key=os.path.getmtime)
+            for name in stored[:max(len(stored) - self.max_entries, 0)]:
+                os.remove(name)
+        except EnvironmentError, e:
+            print "code cache: cannot store K = %d: %s" % (K, e)
+
+    def encode(self, block, K, N, T):
+        """
+        Return the N encoded symbols of the source block of K symbols of
+        T bytes, back to back as get_encodedBlock() gives them, or None
+        if K is left to RaptorEncoder.
+        """
+        if K in self.broken:
+            return None
+        rows = self.rows(K, N)
+        if self.verified.get(K, 0) >= N:
+            return self.apply(rows, block, K, N, T)
+
+        # RaptorEncoder gives the block, the matrix is only checked
+        self.checks += 1
+        encoder = block_encoder(K, N - K, 20)
+        encoder.set_block(block, T)
+        encoder.get_data_access()
+        expected = encoder.get_encodedBlock()
+        if expected != self.apply(rows, block, K, N, T):
+            # a matrix stored by another build of the codec, or damaged
+            if expected != self.apply(self.rows(K, N, reprobe=True), block, K, N, T):
+                print "code cache: K = %d does not match RaptorEncoder, not cached" % K
+                self.broken.add(K)
+                return None
+        self.verified[K] = N
+        return expected
+
+    def apply(self, rows, block, K, N, T):
+        """
+        Return the first N encoded symbols of the block with the rows of
+        its generator matrix.
+        """
+        rows = rows[:N]
+
+        # XOR eight source symbols at a time, in words if T allows
+        word = numpy.uint64 if T % 8 == 0 else numpy.uint8
+        source = numpy.zeros((len(rows[0]) * 8, T), dtype=numpy.uint8)
+        source[:K] = numpy.frombuffer(block, dtype=numpy.uint8, count=K * T).reshape(K, T)
+        source = source.view(word)
+        encoded = numpy.zeros((N, source.shape[1]), dtype=word)
+        table = numpy.zeros((256, source.shape[1]), dtype=word)
+        for group in xrange(len(rows[0])):
+            for bit in xrange(8):
+                table[1 << bit:2 << bit] = table[:1 << bit] ^ source[group * 8 + bit]
+            encoded ^= table[rows[:, group]]
+        return bytearray(encoded.view(numpy.uint8).tostring())
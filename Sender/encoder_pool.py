@@ -0,0 +1,99 @@
+#
+# Reuse of RaptorEncoder instances from one source block to the next.
+#
+# An encoder is built for one K and repair count, which sets up the code
+# of that K and its symbol queues. Once its encoded symbols have been
+# drained it holds nothing of the block, so it can take the next block of
+# the same K, repair count and T. The pool keeps up to max_idle drained
+# encoders by (K, N, T), the least recently used dropped first, and
+# builds a new one only for a (K, N, T) it has none of.
+#
+# The first time an encoder is reused, its encoding is compared with that
+# of a new encoder; if they differ, the pool stops reusing and builds an
+# encoder for every block, as without it.
+#
+
+import threading
+
+# from current dir
+from block_encoder import block_encoder
+
+
+class encoder_pool(object):
+    """
+    Drained RaptorEncoders by (K, N, T).
+
+    Args:
+        max_idle: encoders kept between blocks, 0 to build one per block
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = []              # ((K, N, T), encoder), least recently used first
+        self.checked = False
+        self.lock = threading.Lock()
+        self.built = 0
+        self.reused = 0
+
+    def acquire(self, K, N, T):
+        """
+        Return (encoder, reused): an idle encoder of (K, N, T), or a new one.
+        """
+        key = (K, N, T)
+        self.lock.acquire()
+        try:
+            for i in xrange(len(self.idle) - 1, -1, -1):
+                if self.idle[i][0] == key:
+                    self.reused += 1
+                    return (self.idle.pop(i)[1], True)
+            self.built += 1
+        finally:
+            self.lock.release()
+        return (block_encoder(K, N - K, 20), False)
+
+    def release(self, encoder, K, N, T):
+        """
+        Give back an encoder of (K, N, T); what is left of its encoded
+        symbols is drained.
+        """
+        while not encoder.is_empty():
+            encoder.get_encodedSym()
+        key = (K, N, T)
+        self.lock.acquire()
+        try:
+            if self.max_idle <= 0:
+                return
+            self.idle.append((key, encoder))
+            del self.idle[:-self.max_idle]
+        finally:
+            self.lock.release()
+
+    def encode(self, block, K, N, T):
+        """
+        Encode the source block of K symbols of T bytes into N symbols, as
+        RaptorEncoder(K, N - K, 20) would; returns (count_encodedSym(),
+        get_encodedBlock()).
+        """
+        (encoder, reused) = self.acquire(K, N, T)
+        encoder.set_block(block, T)
+        encoder.get_data_access()
+        result = (encoder.count_encodedSym(), encoder.get_encodedBlock())
+
+        if reused and not self.checked:
+            fresh = block_encoder(K, N - K, 20)
+            fresh.set_block(block, T)
+            fresh.get_data_access()
+            expected = (fresh.count_encodedSym(), fresh.get_encodedBlock())
+            self.checked = True
+            if result != expected:
+                print "encoder pool: a reused RaptorEncoder encodes differently, not reusing"
+                self.max_idle = 0
+                self.lock.acquire()
+                try:
+                    del self.idle[:]
+                finally:
+                    self.lock.release()
+                return expected
+
+        self.release(encoder, K, N, T)
+        return result
@@ -0,0 +1,110 @@
+#
+# H.264 aware source blocks for the raptor sender (--blocking au|gop).
+#
+# Instead of every K * T bytes, the Annex B byte stream of the input is
+# cut at access unit (au) or GOP (gop) boundaries, so that a decoded
+# source block holds whole frames and can go to the player without
+# waiting for the block after it.
+#
+# A block ends at the last boundary that keeps it within K * T bytes;
+# with gop at the last GOP boundary if there is one there, else at the
+# last access unit boundary. An access unit larger than a block is cut
+# at K * T bytes, as without the blocker.
+#
+# An access unit starts with the first AUD, SPS, PPS or SEI NAL unit (or
+# NAL unit types 14 to 18), or the first slice with first_mb_in_slice 0,
+# that follows a slice (H.264 7.4.1.2.3). A GOP starts with the access
+# unit of an IDR picture.
+#
+
+START_CODE = '\0\0\1'
+SLICE, IDR = 1, 5                           # NAL unit types of the slices
+AU_START = frozenset([6, 7, 8, 9, 14, 15, 16, 17, 18])
+LOOKAHEAD = 5                               # start code and two bytes
+
+
+class h264_blocker(object):
+    """
+    Cuts a video_source into source blocks at H.264 access unit or GOP
+    boundaries; blocks() is that of video_source, with blocks of up to
+    blockLen bytes.
+    """
+
+    def __init__(self, source, gop=False):
+        self.source = source
+        self.gop = gop
+
+    def length(self):
+        return self.source.length()
+
+    def close(self):
+        self.source.close()
+
+    def cut(self, data, start, limit, end):
+        """
+        Return where the block of data[start:end] starting at start ends:
+        at end if that is within limit, else at the last boundary after
+        start and within limit, else at limit.
+        """
+        if limit >= end:
+            return end
+
+        au = gop = None
+        auStart = start
+        afterSlice = True
+        # start codes at limit at the most, with the NAL header in data
+        stop = min(limit + 3, end - 1)
+        pos = data.find(START_CODE, start, stop)
+        while pos >= 0:
+            nal = ord(data[pos + 3]) & 0x1f
+            # the zero_byte of a four byte start code goes with the NAL unit
+            boundary = pos
+            if boundary > start and data[boundary - 1] == '\0':
+                boundary -= 1
+
+            isSlice = SLICE <= nal <= IDR
+            # first_mb_in_slice is ue(v): 0 is a single 1 bit
+            firstSlice = isSlice and pos + 4 < end and ord(data[pos + 4]) & 0x80
+            if afterSlice and (nal in AU_START or firstSlice):
+                auStart = boundary
+                if boundary > start:
+                    au = boundary
+            if nal == IDR and auStart > start:
+                gop = auStart
+            afterSlice = isSlice
+            pos = data.find(START_CODE, pos + 3, stop)
+
+        if self.gop and gop is not None:
+            return gop
+        if au is not None:
+            return au
+        return limit
+
+    def blocks(self, blockLen):
+        """
+        Yield (offset, data) for consecutive source blocks of at most
+        blockLen bytes, cut at the boundaries. data is a buffer of the
+        map, or a string read from a stream.
+        """
+        data = self.source.map
+        if data is not None:
+            offset = 0
+            while offset < len(data):
+                cut = self.cut(data, offset, offset + blockLen, len(data))
+                yield (offset, buffer(data, offset, cut - offset))
+                offset = cut
+            return
+
+        # a stream: keep a block and the lookahead in data
+        data = ''
+        offset = 0
+        for (_, more) in self.source.blocks(blockLen):
+            data += more
+            while len(data) > blockLen + LOOKAHEAD:
+                cut = self.cut(data, 0, blockLen, len(data))
+                yield (offset, data[:cut])
+                (data, offset) = (data[cut:], offset + cut)
+        while data:
+            cut = self.cut(data, 0, blockLen, len(data))
+            yield (offset, data[:cut])
+            (data, offset) = (data[cut:], offset + cut)
@@ -0,0 +1,55 @@
+#
+# Token bucket pacing of the packets handed to the PHY.
+#
+# send_pkt() only queues a packet in the modulator, so the senders have
+# to keep the rate themselves. Tokens are bytes of airtime: they come in
+# at the PHY bitrate times the target utilisation, and every packet takes
+# its payload plus the framing mod_pkts adds to it. Up to burst packets
+# may go back to back after the sender has been idle.
+#
+
+import time
+
+
+# bytes mod_pkts puts around a payload: preamble (2), access code (8),
+# header (4), CRC32 (4) and the trailing 0x55
+FRAME_OVERHEAD = 19
+
+
+class pacer(object):
+    """
+    Token bucket for a PHY of the given bitrate (bits/sec).
+
+    Args:
+        utilisation: fraction of the bitrate to use (0 < utilisation <= 1)
+        burst: packets that may be sent back to back
+        frame_overhead: bytes of framing per packet
+    """
+
+    def __init__(self, bitrate, utilisation=0.9, burst=4, frame_overhead=FRAME_OVERHEAD):
+        self.rate = bitrate * utilisation / 8.0        # bytes/sec
+        self.burst = max(burst, 1)
+        self.frame_overhead = frame_overhead
+        self.tokens = None                             # full bucket at the first packet
+        self.last = None
+
+    def wait(self, payload_len):
+        """
+        Sleep until a packet with payload_len bytes of payload may be sent,
+        and take its tokens.
+        """
+        frame = payload_len + self.frame_overhead
+        capacity = self.burst * frame
+        now = time.time()
+        if self.tokens is None:
+            self.tokens = capacity
+        else:
+            self.tokens = min(capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        if self.tokens < frame:
+            time.sleep((frame - self.tokens) / self.rate)
+            now = time.time()
+            self.tokens += (now - self.last) * self.rate
+            self.last = now
+        self.tokens -= frame
@@ -0,0 +1,92 @@
+#
+# Repair symbol count of the next source block from the receiver's reports.
+#
+# Every ACK tells how many symbols of a block were sent and received when
+# it was decoded, and how many the decoder used. The loss rate and the
+# symbols the decoder needs beyond K are smoothed over the blocks; the
+# repair count is then chosen so that, with binomial loss at the smoothed
+# rate, fewer than the needed symbols arrive with at most the target
+# probability.
+#
+
+import math
+import threading
+
+
+def normal_quantile(p):
+    """
+    Return z such that a standard normal variable exceeds z with
+    probability p (0 < p < 1).
+    """
+    upper = lambda z: 0.5 * math.erfc(z / math.sqrt(2))
+    (lo, hi) = (-10.0, 10.0)
+    for i in xrange(100):
+        mid = (lo + hi) / 2
+        if upper(mid) > p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+class repair_estimator(object):
+    """
+    Smoothed loss and decode overhead, and the repair count they call for.
+
+    Args:
+        loss: initial loss rate (0 <= loss < 1)
+        target: acceptable probability that a block gets too few symbols
+        alpha: weight of a new report in the moving averages
+        overhead: initial symbols beyond K the decoder is assumed to need
+        max_loss: the loss rate is never taken above this
+    """
+
+    def __init__(self, loss, target=1e-3, alpha=0.2, overhead=2.0, max_loss=0.9):
+        self.loss = loss
+        self.overhead = overhead
+        self.alpha = alpha
+        self.max_loss = max_loss
+        self.z = normal_quantile(target)
+        self.lock = threading.Lock()
+
+    def update(self, K, decoded, sent, received, used):
+        """
+        Account for the report of one source block: sent and received
+        symbols when it was decoded, and the symbols the decoder used. A
+        block that was given up (decoded False) needed more than it got.
+        """
+        if sent <= 0:
+            return
+        loss = 1.0 - float(min(received, sent)) / sent
+        if decoded:
+            overhead = max(used - K, 0)
+        else:
+            overhead = max(received - K + 1, 2 * self.overhead)
+
+        self.lock.acquire()
+        try:
+            self.loss += self.alpha * (loss - self.loss)
+            self.overhead += self.alpha * (overhead - self.overhead)
+        finally:
+            self.lock.release()
+
+    def repair_count(self, K, limit=None):
+        """
+        Return the repair symbols to send with a block of K source symbols,
+        at most limit.
+        """
+        self.lock.acquire()
+        try:
+            p = min(max(self.loss, 0.0), self.max_loss)
+            need = K + int(math.ceil(self.overhead))
+        finally:
+            self.lock.release()
+
+        # smallest N with N(1-p) - z*sqrt(N p (1-p)) >= need, for x = sqrt(N)
+        q = 1.0 - p
+        s = self.z * math.sqrt(p * q)
+        x = (s + math.sqrt(s * s + 4 * q * need)) / (2 * q)
+        repair = max(int(math.ceil(x * x)) - K, 0)
+        if limit is not None:
+            repair = min(repair, limit)
+        return repair
@@ -48,9 +48,22 @@ from uhd_interface import uhd_receiver
 
 from raptor_encoder import *
 import raptor_encoder
+from repair_estimator import repair_estimator
+from pacer import pacer
+from backpressure import tx_backpressure
+from video_source import video_source
+from h264_blocker import h264_blocker
+from uep import uep_allocator
+from code_cache import code_cache
+from encoder_pool import encoder_pool
+from raptor_packet import ACK_DECODED, MAX_ESI
+from raptor_packet import FRAME_HEADER, GROUP_HEADER, FRAME_SYMBOL, MAX_FRAME_SYMBOLS
+import raptor_packet
 
 import os, sys
 import random, time, struct
+import threading, Queue
+import heapq
 import numpy
 
 #print os.getpid()
@@ -122,6 +135,12 @@ class my_top_block(gr.top_block):
     def send_pkt(self, payload='', eof=False):
         return self.txpath.send_pkt(payload, eof)
 
+    def tx_queue_depth(self):
+        """
+        Return the number of packets waiting for the modulator
+        """
+        return self.txpath.packet_transmitter._pkt_input.msgq().count()
+
     def carrier_sensed(self):
         """
         Return True if the receive path thinks there's carrier
@@ -141,6 +160,11 @@ class my_top_block(gr.top_block):
 #                           Carrier Sense MAC
 # ////////////////////////////////////////////////////////////////////
 
+# The packet and ACK layouts are in raptor_packet.py, shared with the
+# receiver.
+
+MIN_K = 4                       # smallest K of a Raptor code (RFC 5053)
+
 class cs_mac(object):
     """
     Prototype carrier sense MAC
@@ -153,68 +177,136 @@ class cs_mac(object):
     this is just an example.
     """
 
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, stream=0, idle_encoders=4):
         #WYQ Removed
         #self.tun_fd = tun_fd       # file descriptor for TUN/TAP interface
         self.verbose = verbose
+        self.stream = stream       # tells this sender apart at the receiver
         self.tb = None             # top block (access to PHY)
+        self.pacer = None          # token bucket for the packets, if any
+        self.backpressure = None   # tx_backpressure on the PHY queue, if any
+        self.sending = set()       # SBNs of the blocks being sent
+        self.acked = set()         # those of them the receiver decoded
+        self.ack_cond = threading.Condition()
+        self.estimator = None      # repair_estimator fed by the ACKs, if any
+        self.uep = None            # uep_allocator of the repair symbols, if any
+        self.cache = None          # code_cache to encode with, if any
+        self.encoders = encoder_pool(idle_encoders)
+        self.blockK = {}           # SBN -> K of the blocks sent, until their first ACK
+
+    def add_options(normal, expert):
+        """
+        Adds MAC-specific options to the Options Parser
+        """
+        normal.add_option("", "--input", default="./foreman_cif.264",
+                          help="set video file to send, - for stdin [default=%default]")
+        normal.add_option("", "--blocking", type="choice", choices=['bytes', 'au', 'gop'],
+                          default='bytes',
+                          help="cut source blocks every K * T bytes, or at H.264 access unit (au) or GOP (gop) boundaries [default=%default]")
+        normal.add_option("", "--stream", type="intx", default=0,
+                          help="set stream id (0-255) of this sender [default=%default]")
+        normal.add_option("-p", "--PLR", type="intx", default=3,
+                          help="set packet loss rate [default=%default]")
+        normal.add_option("-T", "--packLen", type="intx", default=200,
+                          help="set source symbol numbers [default=%default]")
+        normal.add_option("-K", "--srcSymNum", type="intx", default=1000,
+                          help="set source symbols per source block [default=%default]")
+        normal.add_option("", "--pipeline", action="store_true", default=False,
+                          help="encode the next source block while sending the current one")
+        normal.add_option("", "--queue-depth", type="intx", default=2,
+                          help="set encoded blocks buffered by --pipeline [default=%default]")
+        normal.add_option("", "--aggregate", action="store_true", default=False,
+                          help="pack as many encoded symbols as fit in --size bytes into a packet")
+        normal.add_option("", "--interleave", type="intx", default=1,
+                          help="send the symbols of this many source blocks interleaved, not with --rateless [default=%default]")
+        normal.add_option("", "--rateless", action="store_true", default=False,
+                          help="send repair symbols of a source block until the receiver acknowledges it")
+        normal.add_option("", "--adaptive", action="store_true", default=False,
+                          help="size the repair symbols of each block from the loss the receiver reports")
+        normal.add_option("", "--target-failure", type="eng_float", default=1e-3,
+                          help="set acceptable probability of a block getting too few symbols with --adaptive [default=%default]")
+        normal.add_option("", "--uep", action="store_true", default=False,
+                          help="give more repair symbols to the blocks with H.264 parameter sets and IDR slices")
+        expert.add_option("", "--uep-weights", default="4,2,1,0.5",
+                          help="set repair weights of parameter sets, IDR slices, reference slices and the rest with --uep [default=%default]")
+        normal.add_option("", "--code-cache", default=None,
+                          help="keep the generator matrices of the code in this directory and encode with them")
+        expert.add_option("", "--code-cache-size", type="intx", default=16,
+                          help="set values of K whose matrices --code-cache keeps [default=%default]")
+        expert.add_option("", "--idle-encoders", type="intx", default=4,
+                          help="set encoders kept for the next blocks, 0 builds one per block [default=%default]")
+        expert.add_option("", "--loss-smoothing", type="eng_float", default=0.2,
+                          help="set weight of a new loss report with --adaptive [default=%default]")
+        expert.add_option("", "--utilisation", type="eng_float", default=0.9,
+                          help="set fraction of the PHY bitrate the packets may use [default=%default]")
+        expert.add_option("", "--burst", type="intx", default=4,
+                          help="set packets that may be sent back to back [default=%default]")
+        expert.add_option("", "--tx-high-water", type="intx", default=4,
+                          help="set packets queued in the PHY before the sender waits, 0 for no limit [default=%default]")
+        expert.add_option("", "--tx-low-water", type="intx", default=1,
+                          help="set packets left in the PHY queue when the sender goes on [default=%default]")
+    # Make a static method to call before instantiation
+    add_options = staticmethod(add_options)
 
     def set_top_block(self, tb):
         self.tb = tb
 
-    def pack_pkt(self, SBN, ESI, K, N, T, symbols):
+    def set_pacer(self, pacer):
+        self.pacer = pacer
+
+    def set_backpressure(self, backpressure):
+        self.backpressure = backpressure
 
-        # build the packet to be sent. packet = pktno + pkt + crc32
+    def pack_pkt(self, stream, SBN, ESI, K, N, T, offset, size, symbols):
+
+        # build the packet to be sent. packet = header + symbols
+        #   - version: the wire format version (PKT_VERSION)
+        #   - stream: the id of the sender
         #   - SBN:   source block number of raptor codes
         #   - ESI:   the id of encoded symbols
         #   - K: the number of source symbols
         #   - N: the number of encoded symbols
         #   - T: the length of the source/encoded symbols
-        
-        def hexint(mask):
-            if mask >= 2**31:
-                return int(mask-2**32)
-            return mask
-
-        trunk = ''
-        for symbol in symbols:
-            trunk += struct.pack('!H', symbol & 0xffff)
-        #print "[pack_pkt] SBN: %d  ESI: %d, K: %d, T: %d" % (SBN, ESI, K, T)
-        return (struct.pack('!H', SBN & 0xffff) + struct.pack('!H', ESI & 0xffff) + struct.pack('!H', K & 0xffff) 
-         + struct.pack('!H', N & 0xffff) + struct.pack('!H', T & 0xffff) + trunk)
-
-    def unpack_pkt(self, payload):
-        if len(payload) < 12:
-            return (False, None, None, None)
-        
-        pkt_ok = True
+        #   - offset: the byte offset of the source block in the file
+        #   - size: the length of the source block without padding
+        # the T bytes of the encoded symbol follow the header as they are.
 
-        (SBN,) = struct.unpack('!H', payload[0:2])
-        (ESI,) = struct.unpack('!H', payload[2:4])
-        (K,) = struct.unpack('!H', payload[4:6])
-        (N,) = struct.unpack('!H', payload[6:8])
-        (T,) = struct.unpack('!H', payload[8:10])
-        pkt = payload[10:]
-
-        symbols = list()
+        #print "[pack_pkt] SBN: %d  ESI: %d, K: %d, T: %d" % (SBN, ESI, K, T)
+        return raptor_packet.pack_pkt(stream, SBN, ESI, K, N, T, offset, size, symbols)
 
-        for pos in xrange(0, len(pkt), 2):
-            symbols.append(struct.unpack('!H', pkt[pos:pos+2])[0])
+    def pack_frame(self, stream, T, symbols):
+        """
+        Build an aggregated packet of symbols, a list of (SBN, ESI, K, N,
+        offset, size, symbol) of T bytes each.
+        """
+        return raptor_packet.pack_frame(stream, T, symbols)
 
+    def unpack_pkt(self, payload):
         #print "[unpack_pkt] pkt_ok: %r, SBN: %d  ESI: %d, K: %d, N: %d, T: %d" % (pkt_ok, SBN, ESI, K, N, T)
-        return (pkt_ok, SBN, ESI, K, N, T, symbols)
+        return raptor_packet.unpack_pkt(payload)
     
-    def pack_ack(self, pktno = None):
-        if pktno is None:
-            pktno = self.pktno
+    def set_estimator(self, estimator):
+        self.estimator = estimator
+
+    def set_uep(self, uep):
+        self.uep = uep
 
-        return struct.pack('!HI', pktno & 0xffff)
+    def set_code_cache(self, cache):
+        self.cache = cache
+
+    def pack_ack(self, stream, SBN, flags=ACK_DECODED, sent=0, received=0, used=0):
+        return raptor_packet.pack_ack(stream, SBN, flags, sent, received, used)
 
     def unpack_ack(self, ack):
-        if len(ack) != 2:
-            return (None, None)
+        # returns (stream, SBN, flags, sent, received, used), or None
+        return raptor_packet.unpack_ack(ack)
 
-        return struct.unpack('!HI', ack)
+    def is_acked(self, SBN):
+        self.ack_cond.acquire()
+        try:
+            return (SBN & 0xffff) in self.acked
+        finally:
+            self.ack_cond.release()
 
     def phy_rx_callback(self, ok, payload):
         """
@@ -232,38 +324,102 @@ class cs_mac(object):
             #os.write(self.tun_fd, payload)
             #WYQ added
 
-            #(tries, crc32) = self.unpack_ack(payload)
-            #if tries is None:
-            #    print "got a wrong ack, len(ack) != 6."
-            #else:
-            #    print "ack received. tries = %d  crc = %r" % (tries, crc32)
-            print "start sending a new packet (I mean new data)."
+            ack = self.unpack_ack(payload)
+            if ack is None:
+                print "got a wrong ack, len(ack) = %d." % len(payload)
+                return
+            (stream, SBN, flags, sent, received, used) = ack
+            if stream != self.stream:
+                # for another sender on the same channel
+                return
+            self.ack_cond.acquire()
+            try:
+                # only the first ACK of a block reports its loss. A block
+                # given up by the receiver still needs repair symbols, and
+                # a late ACK must not stop a later block of the same SBN.
+                K = self.blockK.pop(SBN, None)
+                if flags & ACK_DECODED and SBN in self.sending:
+                    self.acked.add(SBN)
+                    self.ack_cond.notify_all()
+            finally:
+                self.ack_cond.release()
+            if self.estimator is not None and K is not None:
+                self.estimator.update(K, flags & ACK_DECODED, sent, received, used)
+            if flags & ACK_DECODED:
+                print "ack received for block %d (%d of %d symbols received, %d used)." % (
+                    SBN, received, sent, used)
+            else:
+                print "block %d given up by the receiver (%d of %d symbols received)." % (
+                    SBN, received, sent)
         else:
             print "Oops! not an ack?"
             #Currently, we just set tx_done to be true
 
-    def main_loop(self, file_data, packetLen, PLR):
+    def main_loop(self, source, packetLen, K, PLR, pipeline=False, queueDepth=2,
+                  rateless=False, frameSize=0, interleave=1):
         """
         Main loop for MAC.
         Only returns if we get an error reading from TUN.
 
+        source is the video_source to send, or an h264_blocker of it;
+        its source blocks are buffers of the input and are only copied
+        symbol by symbol into the encoder. A block shorter than K symbols
+        is encoded with its own K.
+
+        With pipeline set, a worker thread encodes the next source blocks
+        while the current one is being sent; at most queueDepth encoded
+        blocks wait between the two.
+
+        With rateless set, a source block is sent until the receiver
+        acknowledges its SBN as decoded; an ACK of a block it gave up does
+        not count. Once its N symbols are out, the block is encoded again
+        with twice the repair symbols and only the new ones are sent. The
+        repair symbols of a block depend on K and the ESI only, so the
+        longer encoding extends the shorter one.
+
+        With an estimator set, the repair symbols of every block come from
+        the loss the receiver reported for the previous ones instead of
+        PLR. With pipeline, the queued blocks were sized before the latest
+        reports. With a uep_allocator set, that count is then shifted
+        towards the blocks with the more important H.264 data.
+
+        With a code_cache set, blocks are encoded with its generator
+        matrices; RaptorEncoder only builds those of a new K. Otherwise
+        the RaptorEncoders of a (K, N, T) are reused from block to block.
+
+        With frameSize set, the encoded symbols are packed into packets of
+        up to frameSize bytes, with the ESI of each; a packet is filled
+        across the end of a block with the symbols of the next. With
+        interleave above 1 (not with rateless), that many blocks are
+        sent at a time, the symbols of each spread evenly over the run,
+        so that a lost packet takes fewer symbols of any one block. A
+        frameSize too small for even one symbol sends a symbol a packet.
+
         FIXME: may want to check for EINTR and EAGAIN and reissue read
         """
         min_delay = 0.001               # seconds
 
+        if frameSize and frameSize < raptor_packet.min_frame_size(packetLen):
+            print "frame size %d holds no %d-byte symbol: not aggregating" % (frameSize, packetLen)
+            frameSize = 0
+
         # WYQ:2014/02/24
-        def send_video_pkt(SBN, ESI, K, N, T, symbols='', eof=False):
+        def send_video_pkt(SBN, ESI, K, N, T, offset, size, symbols='', eof=False):
             #WYQ Removed
             #payload = os.read(self.tun_fd, 10*1024)
             #WYQ added
-            payload = self.pack_pkt(SBN, ESI, K, N, T, symbols)
+            send_payload(self.pack_pkt(self.stream, SBN, ESI, K, N, T, offset, size, symbols))
+
+        def send_payload(payload):
             # let it loop forever. the receiver doesn't handle the 'eof' now.
             if not payload:  # it may not happen
                 print "can't get a packet from raptor to send. exit."
                 self.tb.txpath.send_pkt(eof=True)
                 #break
-            # 1 pkt per second 
-            time.sleep(0.04)
+            if self.pacer is not None:
+                self.pacer.wait(len(payload))
+            if self.backpressure is not None:
+                self.backpressure.wait()
 
             if self.verbose:
                 m=1
@@ -278,19 +434,43 @@ class cs_mac(object):
                     delay = delay * 2       # exponential back-off
 
             self.tb.send_pkt(payload)
-
-        file_length = len(file_data)
-        #print "file length is ", file_length
-
-        #The number of the source symbols
+            counts['packets'] += 1
+
+        # symbols waiting for the packet being filled with frameSize, and
+        # the SBNs among them
+        frame = []
+        frameBlocks = set()
+        counts = {'packets': 0, 'frame': FRAME_HEADER.size}
+
+        def send_symbol(SBN, ESI, K, N, offset, size, symbol):
+            if not frameSize:
+                send_video_pkt(SBN, ESI, K, N, packetLen, offset, size, symbol)
+                return
+            grow = FRAME_SYMBOL.size + packetLen
+            if SBN not in frameBlocks:
+                grow += GROUP_HEADER.size
+            if frame and (counts['frame'] + grow > frameSize or len(frame) >= MAX_FRAME_SYMBOLS):
+                flush_frame()
+                grow = GROUP_HEADER.size + FRAME_SYMBOL.size + packetLen
+            frame.append((SBN, ESI, K, N, offset, size, symbol))
+            frameBlocks.add(SBN)
+            counts['frame'] += grow
+
+        def flush_frame():
+            if frame:
+                send_payload(self.pack_frame(self.stream, packetLen, frame))
+                del frame[:]
+                frameBlocks.clear()
+                counts['frame'] = FRAME_HEADER.size
+
+        #print "file length is ", source.length()
+
+        #The number of the source symbols per source block
         #K = file_length // packetLen
-        K = 1000
-        lossNum = (K + K * PLR // 100 + 8) * PLR // 100
+        blockLen = K * packetLen
 
         #print "K = %d, PLR = %d, lossNum = %d" %(K, PLR, lossNum)
 
-        encoder = raptor_encoder.RaptorEncoder(K, lossNum, 20)
-
         #index = 0;
         #i = 0
         #while i < K:
@@ -307,56 +487,144 @@ class cs_mac(object):
         #    i += 1
 
 
-        sendPktLen = 0
-        # WYQ:2014/02/24
+        # the file is cut into source blocks of up to K symbols (fewer at
+        # the end, or where source cuts at a frame boundary); a block is
+        # zero-padded to whole symbols, its size tells the receiver where
+        # to cut.
+        def encode(block, symNum, repairNum):
+            if self.cache is not None:
+                encoded_block = self.cache.encode(block, symNum, symNum + repairNum, packetLen)
+                if encoded_block is not None:
+                    return (symNum + repairNum, encoded_block)
+
+            # an encoder of the pool, drained of the block before
+            return self.encoders.encode(block, symNum, symNum + repairNum, packetLen)
+
+        def encode_blocks():
+            SBN = 0
+            for (offset, data) in source.blocks(blockLen):
+                size = len(data)
+                symNum = max((size + packetLen - 1) // packetLen, MIN_K)
+                block = data
+                if size < symNum * packetLen:
+                    block = str(data) + '\0' * (symNum * packetLen - size)
+
+                repairNum = (symNum + symNum * PLR // 100 + 8) * PLR // 100
+                if self.estimator is not None:
+                    repairNum = self.estimator.repair_count(symNum, MAX_ESI - symNum)
+                if self.uep is not None:
+                    repairNum = self.uep.repair_count(data, repairNum, MAX_ESI - symNum)
+                (N, encoded_block) = encode(block, symNum, repairNum)
+                yield (SBN, offset, size, symNum, block, N, encoded_block)
+
+                SBN += 1
+
+        def encode_worker(blocks):
+            try:
+                for encoded in encode_blocks():
+                    blocks.put(encoded)
+            except Exception, e:
+                blocks.put(e)
+                raise
+            blocks.put(None)
+
+        if pipeline:
+            # double buffering: encode block n+1 while block n is on the air
+            blocks = Queue.Queue(maxsize=queueDepth)
+            worker = threading.Thread(target=encode_worker, args=(blocks,))
+            worker.daemon = True
+            worker.start()
+            encoded_blocks = iter(blocks.get, None)
+        else:
+            encoded_blocks = encode_blocks()
+
+        def block_symbols(encoded):
+            # (SBN, ESI, K, N, offset, size, symbol) of every symbol to
+            # send of an encoded block
+            (SBN, offset, size, symNum, block, N, encoded_block) = encoded
+            print "source block %d: offset = %d, size = %d, K = %d, N = %d" % (
+                SBN, offset, size, symNum, N)
+
+            self.ack_cond.acquire()
+            self.sending.add(SBN & 0xffff)
+            self.acked.discard(SBN & 0xffff)
+            self.blockK[SBN & 0xffff] = symNum
+            self.ack_cond.release()
+
+            ESI = 0
+            repairNum = N - symNum
+            while True:
+                while ESI < N:
+                    if rateless and self.is_acked(SBN):
+                        break
+                    payload = encoded_block[ESI * packetLen:(ESI + 1) * packetLen]
+                    yield (SBN, ESI, symNum, N, offset, size, payload)
+                    ESI += 1
+
+                if not rateless or self.is_acked(SBN):
+                    break
+                if N >= MAX_ESI:
+                    print "no ack for block %d after %d symbols, giving up." % (SBN, N)
+                    break
+                repairNum = min(max(2 * repairNum, 8), MAX_ESI - symNum)
+                (N, encoded_block) = encode(block, symNum, repairNum)
+                print "source block %d: no ack yet, N = %d" % (SBN, N)
+
+            # done with the block: forget its ACK before the SBN comes round
+            self.ack_cond.acquire()
+            self.sending.discard(SBN & 0xffff)
+            self.acked.discard(SBN & 0xffff)
+            self.ack_cond.release()
+
+        def interleaved(group):
+            # the symbols of a group of blocks, each block's spread evenly
+            heap = [(0.5 / encoded[5], i, block_symbols(encoded), encoded[5])
+                    for (i, encoded) in enumerate(group)]
+            heapq.heapify(heap)
+            while heap:
+                (due, i, symbols, N) = heapq.heappop(heap)
+                for symbol in symbols:
+                    yield symbol
+                    heapq.heappush(heap, (due + 1.0 / N, i, symbols, N))
+                    break
+
+        def block_groups():
+            group = []
+            for encoded in encoded_blocks:
+                if isinstance(encoded, Exception):
+                    raise encoded
+                group.append(encoded)
+                if rateless or len(group) >= interleave:
+                    yield group
+                    group = []
+            if group:
+                yield group
+
+        startTime = time.time()
+        firstPktTime = None
         pktNum = 0
-        #while (sendPktLen + packetLen) <= file_length:
-        while pktNum < K:
-            src_symbols = raptor_encoder.vectoruc()
-
-            curPktEnd = sendPktLen + packetLen
-            data = file_data[sendPktLen:curPktEnd]
-            #data_list = list(data)
-
-            #src_symbols = file_data[sendPktLen:curPktEnd]
-
-            # add error handling here 021609
-            # except (KeyboardInterrupt, SystemExit):
-            #    raise
-            if not data:
-                break
-
-            #i = 0
-            #while i < packetLen:
-            #    print data_list[i]
-            #    #src_symbols.append(data_list[i])
-            #    i += 1
-
-            #print list(src_symbols)
-            #print "\n"
-            #encoder.set_data(src_symbols)
-            #src_symbols.clear()
-            encoder.set_data(data)
-            sendPktLen += packetLen
-            pktNum += 1
-
-        #data = file_data[sendPktLen:file_length] + 6 * "0"
-        #print len(data)
-        #encoder.set_data(data)
-
-        #get the encoded symbols after raptor encoding
-        encoder.get_data_access()
-        N = encoder.count_encodedSym()
-        SBN = 0
-        ESI = 0
-        #print "encoded symbols number = %4d" % N
-        while encoder.is_empty() is False:
-            encoded_symbols = encoder.get_encodedSym()
-            payload = list(encoded_symbols)
-            #print payload
-            #print "\n"
-            send_video_pkt(SBN, ESI, K, N, packetLen, payload)
-            ESI += 1
+        file_length = 0
+        for group in block_groups():
+            file_length += sum(encoded[2] for encoded in group)
+            if len(group) == 1:
+                symbols = block_symbols(group[0])
+            else:
+                symbols = interleaved(group)
+            for (SBN, ESI, symNum, N, offset, size, payload) in symbols:
+                send_symbol(SBN, ESI, symNum, N, offset, size, payload)
+                if firstPktTime is None:
+                    firstPktTime = time.time()
+                pktNum += 1
+        flush_frame()
+
+        endTime = time.time()
+        if firstPktTime is not None:
+            print "time to first packet: %.3f sec" % (firstPktTime - startTime)
+            print "sent %d symbols in %d packets for %d bytes in %.3f sec" % (
+                pktNum, counts['packets'], file_length, endTime - startTime)
+            if endTime > firstPktTime:
+                print "steady-state goodput: %sb/sec" % (
+                    eng_notation.num_to_str(file_length * 8 / (endTime - firstPktTime)),)
 
 
 # /////////////////////////////////////////////////////////////////////////////
@@ -379,11 +647,7 @@ def main():
                       help="set packet size [default=%default]")
     parser.add_option("-v","--verbose", action="store_true", default=False)
 
-    parser.add_option("-p", "--PLR", type="intx", default=3,
-                      help="set packet loss rate [default=%default]")
-    parser.add_option("-T", "--packLen", type="intx", default=200,
-                      help="set source symbol numbers [default=%default]")
-
+    cs_mac.add_options(parser, expert_grp)
 
     expert_grp.add_option("-c", "--carrier-threshold", type="eng_float", default=30,
                           help="set carrier detect threshold (dB) [default=%default]")
@@ -406,6 +670,11 @@ def main():
         parser.print_help(sys.stderr)
         sys.exit(1)
 
+    if options.aggregate and options.size < raptor_packet.min_frame_size(options.packLen):
+        sys.stderr.write("--aggregate needs a --size of at least %d bytes for %d-byte symbols\n"
+                         % (raptor_packet.min_frame_size(options.packLen), options.packLen))
+        sys.exit(1)
+
     # open the TUN/TAP interface
     #(tun_fd, tun_ifname) = open_tun_interface(options.tun_device_filename)
 
@@ -424,7 +693,15 @@ def main():
 
     # instantiate the MAC
     #mac = cs_mac(tun_fd, verbose=True)
-    mac = cs_mac(verbose=True)
+    mac = cs_mac(verbose=True, stream=options.stream, idle_encoders=options.idle_encoders)
+    if options.adaptive:
+        # start from the loss rate given with -p
+        mac.set_estimator(repair_estimator(options.PLR / 100.0, options.target_failure,
+                                           options.loss_smoothing))
+    if options.uep:
+        mac.set_uep(uep_allocator([float(x) for x in options.uep_weights.split(',')]))
+    if options.code_cache is not None:
+        mac.set_code_cache(code_cache(options.code_cache, options.code_cache_size))
 
     # build the graph (PHY)
     tb = my_top_block(mods[options.modulation],
@@ -433,6 +710,10 @@ def main():
                       options)
 
     mac.set_top_block(tb)    # give the MAC a handle for the PHY
+    mac.set_pacer(pacer(tb.txpath.bitrate(), options.utilisation, options.burst))
+    if options.tx_high_water > 0:
+        mac.set_backpressure(tx_backpressure(tb.tx_queue_depth, options.tx_high_water,
+                                             options.tx_low_water))
 
     if tb.txpath.bitrate() != tb.rxpath.bitrate():
         print "WARNING: Transmit bitrate = %sb/sec, Receive bitrate = %sb/sec" % (
@@ -447,24 +728,28 @@ def main():
     tb.rxpath.set_carrier_threshold(options.carrier_threshold)
     print "Carrier sense threshold:", options.carrier_threshold, "dB"
     
-    source_file = open('./foreman_cif.264', 'r')
+    source = video_source(options.input)
+    if options.blocking != 'bytes':
+        source = h264_blocker(source, options.blocking == 'gop')
     #print 'zhifeng: from file'
     #print 'source_file = ', source_file
-    file_data = source_file.read()
-    file_length = len(file_data)
-    #print "file length is", file_length
-    #print file_data
+    #print "file length is", source.length()
     #raw_input('zhifeng on 070928: press any key to continue') 
-    source_file.close()
 
     tb.start()    # Start executing the flow graph (runs in separate threads)
 
     #K = 100
     print "PLR:     %s"   % (options.PLR,)
-    mac.main_loop(file_data, options.packLen, options.PLR)    # don't expect this to return...
+    frameSize = 0
+    if options.aggregate:
+        frameSize = int(options.size)
+    mac.main_loop(source, options.packLen, options.srcSymNum, options.PLR,
+                  options.pipeline, options.queue_depth, options.rateless,
+                  frameSize, options.interleave)    # don't expect this to return...
 
     tb.stop()     # but if it does, tell flow graph to stop.
     tb.wait()     # wait for it to finish
+    source.close()
                 
 
 if __name__ == '__main__':
@@ -45,6 +45,9 @@ from receive_path  import receive_path
 from transmit_path import transmit_path
 from uhd_interface import uhd_transmitter
 from uhd_interface import uhd_receiver
+from pacer import pacer
+from backpressure import tx_backpressure
+from video_source import video_source
 
 import os, sys
 import random, time, struct
@@ -119,6 +122,12 @@ class my_top_block(gr.top_block):
     def send_pkt(self, payload='', eof=False):
         return self.txpath.send_pkt(payload, eof)
 
+    def tx_queue_depth(self):
+        """
+        Return the number of packets waiting for the modulator
+        """
+        return self.txpath.packet_transmitter._pkt_input.msgq().count()
+
     def carrier_sensed(self):
         """
         Return True if the receive path thinks there's carrier
@@ -155,10 +164,37 @@ class cs_mac(object):
         #self.tun_fd = tun_fd       # file descriptor for TUN/TAP interface
         self.verbose = verbose
         self.tb = None             # top block (access to PHY)
+        self.pacer = None          # token bucket for the packets, if any
+        self.backpressure = None   # tx_backpressure on the PHY queue, if any
+
+    def add_options(normal, expert):
+        """
+        Adds MAC-specific options to the Options Parser
+        """
+        normal.add_option("", "--input", default="./foreman_cif.264",
+                          help="set video file to send, - for stdin [default=%default]")
+        normal.add_option("-T", "--packetLen", type="intx", default=3,
+                          help="set source symbol numbers [default=%default]")
+        expert.add_option("", "--utilisation", type="eng_float", default=0.9,
+                          help="set fraction of the PHY bitrate the packets may use [default=%default]")
+        expert.add_option("", "--burst", type="intx", default=4,
+                          help="set packets that may be sent back to back [default=%default]")
+        expert.add_option("", "--tx-high-water", type="intx", default=4,
+                          help="set packets queued in the PHY before the sender waits, 0 for no limit [default=%default]")
+        expert.add_option("", "--tx-low-water", type="intx", default=1,
+                          help="set packets left in the PHY queue when the sender goes on [default=%default]")
+    # Make a static method to call before instantiation
+    add_options = staticmethod(add_options)
 
     def set_top_block(self, tb):
         self.tb = tb
 
+    def set_pacer(self, pacer):
+        self.pacer = pacer
+
+    def set_backpressure(self, backpressure):
+        self.backpressure = backpressure
+
     def phy_rx_callback(self, ok, payload):
         """
         Invoked by thread associated with PHY to pass received packet up.
@@ -177,31 +213,32 @@ class cs_mac(object):
             (pktno,) = struct.unpack('!H', payload[0:2])
             print "Ack received!"
 
-    def main_loop(self, file_data, packetLen):
+    def main_loop(self, source, packetLen):
         """
         Main loop for MAC.
         Only returns if we get an error reading from TUN.
 
+        source is the video_source to send, packetLen bytes a packet.
+
         FIXME: may want to check for EINTR and EAGAIN and reissue read
         """
 
-        file_length = len(file_data)
-        #print "file length is ", file_length
+        #print "file length is ", source.length()
         
-        sendPktLen = 0
         pktno = 0
-        # WYQ:2014/02/24
-        while pktno < 1000:
-        #while (sendPktLen + packetLen) <= file_length:
-            curPktEnd = sendPktLen + packetLen
-            data = file_data[sendPktLen:curPktEnd]
-            sendPktLen += packetLen
+        for (offset, data) in source.blocks(packetLen):
+            # WYQ:2014/02/24
+            if pktno >= 1000:
+                break
             #print "packet size ", len(data)
 
-            payload = struct.pack('!H', pktno) + data
+            payload = struct.pack('!H', pktno) + str(data)
+            if self.pacer is not None:
+                self.pacer.wait(len(payload))
+            if self.backpressure is not None:
+                self.backpressure.wait()
             self.tb.send_pkt(payload)
             pktno += 1
-            time.sleep(0.05)
 
 
 # /////////////////////////////////////////////////////////////////////////////
@@ -223,9 +260,8 @@ def main():
     parser.add_option("-s", "--size", type="eng_float", default=1500,
                       help="set packet size [default=%default]")
     parser.add_option("-v","--verbose", action="store_true", default=False)
-    parser.add_option("-T", "--packetLen", type="intx", default=3,
-                      help="set source symbol numbers [default=%default]")
 
+    cs_mac.add_options(parser, expert_grp)
 
     expert_grp.add_option("-c", "--carrier-threshold", type="eng_float", default=30,
                           help="set carrier detect threshold (dB) [default=%default]")
@@ -275,6 +311,10 @@ def main():
                       options)
 
     mac.set_top_block(tb)    # give the MAC a handle for the PHY
+    mac.set_pacer(pacer(tb.txpath.bitrate(), options.utilisation, options.burst))
+    if options.tx_high_water > 0:
+        mac.set_backpressure(tx_backpressure(tb.tx_queue_depth, options.tx_high_water,
+                                             options.tx_low_water))
 
     if tb.txpath.bitrate() != tb.rxpath.bitrate():
         print "WARNING: Transmit bitrate = %sb/sec, Receive bitrate = %sb/sec" % (
@@ -289,22 +329,19 @@ def main():
     tb.rxpath.set_carrier_threshold(options.carrier_threshold)
     print "Carrier sense threshold:", options.carrier_threshold, "dB"
     
-    source_file = open('./foreman_cif.264', 'r')
+    source = video_source(options.input)
     #print 'zhifeng: from file'
     #print 'source_file = ', source_file
-    file_data = source_file.read()
-    file_length = len(file_data)
-    #print "file length is", file_length
-    #print file_data
+    #print "file length is", source.length()
     #raw_input('zhifeng on 070928: press any key to continue') 
-    source_file.close()
 
     tb.start()    # Start executing the flow graph (runs in separate threads)
 
-    mac.main_loop(file_data, options.packetLen)    # don't expect this to return...
+    mac.main_loop(source, options.packetLen)    # don't expect this to return...
 
     tb.stop()     # but if it does, tell flow graph to stop.
     tb.wait()     # wait for it to finish
+    source.close()
                 
 
 if __name__ == '__main__':
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#
+# Unit tests of uep.py: python test_uep.py
+#
+
+import unittest
+
+# from current dir
+from uep import uep_allocator
+
+
+def nal_unit(header, length=100):
+    return '\0\0\1' + chr(header) + '\x55' * (length - 4)
+
+SPS_UNIT = nal_unit(0x67)           # parameter set, weight 4 by default
+NON_REFERENCE = nal_unit(0x01)      # non-reference slice, weight 0.5
+
+
+class uep_allocator_test(unittest.TestCase):
+
+    def test_weighted_block(self):
+        uep = uep_allocator()
+        self.assertEqual(uep.repair_count(SPS_UNIT, 10), 40)
+
+    def test_low_weight_block_keeps_a_repair_symbol(self):
+        uep = uep_allocator()
+        for i in xrange(10):
+            uep.repair_count(SPS_UNIT, 2)
+        # 2 * 0.5 / 4 rounds to 0
+        self.assertEqual(uep.repair_count(NON_REFERENCE, 2), 1)
+
+    def test_no_repair_stays_none(self):
+        uep = uep_allocator()
+        self.assertEqual(uep.repair_count(NON_REFERENCE, 0), 0)
+
+    def test_limit(self):
+        uep = uep_allocator()
+        self.assertEqual(uep.repair_count(SPS_UNIT, 10, 25), 25)
+        self.assertEqual(uep.repair_count(NON_REFERENCE, 2, 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
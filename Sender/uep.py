@@ -0,0 +1,108 @@
+#
+# Unequal error protection (--uep): more repair symbols for the source
+# blocks that carry the H.264 data the decoder cannot do without, fewer
+# for the others, for about the airtime of uniform protection.
+#
+# The bytes of a block are put into priority classes by the NAL unit they
+# belong to:
+#
+#   0  parameter sets (SPS, PPS)
+#   1  IDR slices
+#   2  other reference slices (nal_ref_idc > 0)
+#   3  everything else: non-reference slices, SEI, AUD, ...
+#
+# A block's weight is the mean class weight of its bytes. Its repair
+# symbols are those of uniform protection times its weight over the mean
+# weight of the blocks before it, so that in the long run as many repair
+# symbols are sent as with uniform protection. The first block, with the
+# parameter sets and the first IDR picture, gets its weight in full. A
+# block that would have repair symbols under uniform protection keeps at
+# least one, so that a single lost packet does not lose it.
+# Works best with --blocking au or gop, which keep the classes of a
+# picture in as few blocks as possible.
+#
+
+import numpy
+
+# from current dir
+from h264_blocker import SLICE, IDR
+
+PARAMETER_SETS, IDR_SLICES, REFERENCE, OTHER = range(4)
+SPS, PPS = 7, 8
+
+
+def class_bytes(data, first=OTHER):
+    """
+    Return the bytes of data (Annex B) in each priority class; bytes
+    before the first start code are taken to be of class first.
+    """
+    a = numpy.frombuffer(data, numpy.uint8)
+    counts = numpy.zeros(4)
+    if len(a) < 4:
+        counts[first] = len(a)
+        return (counts, first)
+
+    starts = numpy.flatnonzero((a[:-3] == 0) & (a[1:-2] == 0) & (a[2:-1] == 1))
+    if not len(starts):
+        counts[first] = len(a)
+        return (counts, first)
+
+    headers = a[starts + 3]
+    types = headers & 0x1f
+    classes = numpy.empty(len(starts), dtype=numpy.intp)
+    classes.fill(OTHER)
+    classes[(types >= SLICE) & (types < IDR) & (headers & 0x60 > 0)] = REFERENCE
+    classes[types == IDR] = IDR_SLICES
+    classes[(types == SPS) | (types == PPS)] = PARAMETER_SETS
+
+    lengths = numpy.diff(numpy.append(starts, len(a)))
+    counts += numpy.bincount(classes, weights=lengths, minlength=4)
+    counts[first] += starts[0]
+    return (counts, classes[-1])
+
+
+class uep_allocator(object):
+    """
+    Repair symbols of each source block by the priority of its bytes.
+
+    Args:
+        weights: repair weight of the classes PARAMETER_SETS, IDR_SLICES,
+                 REFERENCE and OTHER
+    """
+
+    def __init__(self, weights=(4.0, 2.0, 1.0, 0.5)):
+        self.weights = numpy.array(weights, dtype=float)
+        self.last = OTHER           # class of the NAL unit the last block ended in
+        self.uniform = 0            # repair symbols of uniform protection so far
+        self.weighted = 0.0         # the same, times the weight of each block
+
+    def weight(self, data):
+        """
+        Return the mean class weight of the bytes of a source block. The
+        blocks must come in order: a NAL unit cut by the end of one block
+        goes on in the next.
+        """
+        (counts, self.last) = class_bytes(data, self.last)
+        total = counts.sum()
+        if total == 0:
+            return 1.0
+        return float(numpy.dot(counts, self.weights) / total)
+
+    def repair_count(self, data, repairNum, limit=None):
+        """
+        Return the repair symbols of the source block data, given the
+        repairNum of uniform protection: at least 1 if repairNum is, and
+        at most limit.
+        """
+        weight = self.weight(data)
+        mean = 1.0
+        if self.uniform > 0:
+            mean = self.weighted / self.uniform
+        repair = int(round(repairNum * weight / mean))
+        if repairNum > 0:
+            repair = max(repair, 1)
+        if limit is not None:
+            repair = min(repair, limit)
+        self.uniform += repairNum
+        self.weighted += repairNum * weight
+        return repair
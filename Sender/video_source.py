@@ -0,0 +1,73 @@
+#
+# Input of the senders: the video file given with --input.
+#
+# A regular file is mapped into memory, and the pieces handed out are
+# buffer() views of the map: nothing is copied until a symbol goes to the
+# encoder or into a packet, the pages are read as they are needed, and
+# memory use does not grow with the file. Anything that cannot be mapped
+# (stdin as '-', a pipe, an empty file) is read one piece at a time
+# instead.
+#
+
+import mmap
+import os, sys
+import stat
+
+
+class video_source(object):
+    """
+    The bytes of the input, cut into consecutive pieces by blocks().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.file = sys.stdin
+        else:
+            self.file = open(path, 'rb')
+        self.map = None
+        try:
+            st = os.fstat(self.file.fileno())
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            self.map = None
+
+    def length(self):
+        """
+        Return the size of the input in bytes, or None if it is a stream.
+        """
+        if self.map is None:
+            return None
+        return len(self.map)
+
+    def blocks(self, blockLen):
+        """
+        Yield (offset, data) for consecutive pieces of blockLen bytes; only
+        the last one may be shorter. data is a buffer of the map, or a
+        string read from a stream; both slice into strings.
+        """
+        offset = 0
+        if self.map is not None:
+            while offset < len(self.map):
+                yield (offset, buffer(self.map, offset, blockLen))
+                offset += blockLen
+            return
+
+        while True:
+            # file.read() only returns less than asked at the end
+            data = self.file.read(blockLen)
+            if not data:
+                return
+            yield (offset, data)
+            offset += len(data)
+
+    def close(self):
+        """
+        Unmap and close the input. No buffer of blocks() may be used after.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not sys.stdin:
+            self.file.close()